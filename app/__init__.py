@@ -1,5 +1,5 @@
 import os
-from flask import Flask, session, render_template, request, redirect
+from flask import Flask, session, render_template, request, redirect, jsonify
 
 SITE_ROOT = os.path.realpath(os.path.dirname(__file__))
 
@@ -8,41 +8,145 @@ def create_app(test_config=None):
     app = Flask(__name__)
     app.secret_key = 'SECRET_KEY'
     app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+    app.config['FIREBASE_POOL_SIZE'] = int(os.environ.get('FIREBASE_POOL_SIZE', 10))
+    app.config['IMAGE_CACHE_BACKEND'] = os.environ.get('IMAGE_CACHE_BACKEND', 'memory')
+
+    # Upload limits: per file (users may have a lower one), and per request so
+    # oversized bodies are refused before Werkzeug parses them
+    app.config['UPLOAD_MAX_BYTES'] = int(os.environ.get('UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+    app.config['MAX_CONTENT_LENGTH'] = app.config['UPLOAD_MAX_BYTES'] + 1024 * 1024
+
+    # Queued, level-gated logging with per-module levels, e.g. LOG_LEVELS="app.classes.Database=DEBUG"
+    from app.classes.Logging import Logging
+    app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    app.config['LOG_LEVELS'] = Logging.parse_levels(os.environ.get('LOG_LEVELS'))
+    Logging(app)
+
+    # Server-side sessions: the cookie only carries an opaque id
+    from app.classes.Session import Sessions
+    app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'memory')
+    Sessions(app)
+
+    # Per-request timing spans, Prometheus histograms and the slow request profiler
+    from app.classes.Metrics import Metrics
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    app.config['METRICS_PROFILE'] = os.environ.get('METRICS_PROFILE', '') == '1'
+    Metrics(app)
+
+    # Shared Firebase client, reused by every Database instance
+    from app.classes.Firebase import Firebase
+    Firebase(app)
+
+    # Local stand-in for Firebase, for development and load tests
+    app.config['FIREBASE_EMULATOR'] = os.environ.get('FIREBASE_EMULATOR', '') == '1'
+    app.config['FIREBASE_EMULATOR_LATENCY'] = float(os.environ.get('FIREBASE_EMULATOR_LATENCY', 0))
+    if app.config['FIREBASE_EMULATOR']:
+        from app.classes.FirebaseEmulator import FirebaseEmulator
+        FirebaseEmulator(app)
+
+    # Concurrent independent reads for pages that need several
+    from app.classes.QueryExecutor import QueryExecutor
+    QueryExecutor(app)
+
+    # Optional local mirror of the images and users nodes
+    app.config['REPLICA_ENABLED'] = os.environ.get('REPLICA_ENABLED', '') == '1'
+    if app.config['REPLICA_ENABLED']:
+        from app.classes.Replica import Replica
+        Replica(app)
+
+    # Read-through cache for image listings
+    from app.classes.Cache import Cache
+    Cache(app)
+
+    # Background processing of uploads
+    from app.classes.Jobs import Jobs
+    from app.models.Image import Image
+    jobs = Jobs(app)
+    jobs.register("upload", Image.process_upload, Image.complete_upload, Image.fail_upload)
+
+    # On-disk cache of server-side filtered renditions
+    from app.classes.DiskCache import DiskCache
+    app.config.setdefault('FILTER_WIDTHS', [320, 640, 1280])
+    app.config.setdefault('RENDITION_CACHE_DIR', os.path.join(app.instance_path, 'renditions'))
+    app.config.setdefault('RENDITION_CACHE_BYTES', 512 * 1024 * 1024)
+    app.extensions['renditions'] = DiskCache(app.config['RENDITION_CACHE_DIR'], app.config['RENDITION_CACHE_BYTES'])
+    from app.classes.Filters import Filters
+    app.jinja_env.globals['baked_filters'] = Filters.catalogue
+    app.jinja_env.globals['filters_version'] = Filters.version
+
+    # Batched writes of like toggles
+    from app.classes.LikeBuffer import LikeBuffer
+    LikeBuffer(app)
+
+    # Shared loading of the in-process indexes below, refreshed off the request path
+    from app.classes.IndexLoader import IndexLoader
+    IndexLoader(app)
+
+    # In-process ranking behind the trending feed
+    from app.classes.TrendingIndex import TrendingIndex
+    TrendingIndex(app)
+
+    # In-process full-text index behind search
+    from app.classes.SearchIndex import SearchIndex
+    SearchIndex(app)
+
+    # In-process perceptual hash index for duplicates and similar images
+    from app.classes.SimilarityIndex import SimilarityIndex
+    SimilarityIndex(app)
+
+    # Fingerprinted asset URLs with long-lived immutable caching
+    from app.classes.Assets import Assets
+    Assets(app)
+
+    # Compressed, conditional responses for the JSON API
+    from app.classes.Compression import Compression
+    Compression(app)
+
+    # Grid tiles rendered once per image version
+    from app.classes.Fragments import Fragments
+    Fragments(app)
 
     @app.before_request
     def before_request_func():
-        open_routes = ['home.index', 'account.login', 'account.register']
-        if not session.get('logged_in'):
-            session['logged_in'] = False
-            session['user'] = None
-            if (request.endpoint and
-                'static' not in request.endpoint and 
-                request.endpoint not in open_routes):
-                return redirect('/')
+        open_routes = ['home.index', 'account.login', 'account.register', 'metrics.index', 'metrics.profiles']
+        # Static files and open routes never read the session store, and
+        # anonymous visitors are not given defaults, so they never create a stored session
+        if (request.endpoint and
+            'static' not in request.endpoint and 
+            request.endpoint not in open_routes and
+            not session.get('logged_in')):
+            # API clients get an error they can handle rather than the home page
+            if request.blueprint in ('api', 'api_latest'):
+                return jsonify({"error": "Please log in."}), 401
+            return redirect('/')
 
     @app.context_processor
     def inject_user():
         user = {
-            "logged_in": session['logged_in'],
-            "user_data": session['user']
+            "logged_in": session.get('logged_in', False),
+            "user_data": session.get('user')
         }
         return dict(user=user)
 
     @app.after_request
     def after_request_func(response):
         if request.endpoint and 'static' not in request.endpoint:
-            app.logger.info('################ SESSIONINFO #######################')
-            app.logger.info(session)
             #OPTIONAL - enable to clear flash
             session.pop('_flashes', None)
         return response
 
+    # Whole pages for anonymous visitors, with ETag revalidation. Registered
+    # after the hooks above, so the login redirect always runs first
+    from app.classes.PageCache import PageCache
+    PageCache(app)
+
     @app.errorhandler(404)
     def page_not_found(e):
         # note that we set the 404 status explicitly
         return render_template('404.html'), 404
 
     router(app)
+    commands(app)
     return app
     
 
@@ -51,7 +155,70 @@ def router(app):
     from app.controllers import Home
     from app.controllers import Account
     from app.controllers import Images
+    from app.controllers import Media
+    from app.controllers import Metrics
+    from app.controllers import Api
 
     app.register_blueprint(Home.bp)
     app.register_blueprint(Account.bp)
-    app.register_blueprint(Images.bp)
\ No newline at end of file
+    app.register_blueprint(Images.bp)
+    app.register_blueprint(Media.bp)
+    app.register_blueprint(Metrics.bp)
+    app.register_blueprint(Api.bp)
+    # Unversioned alias for the latest API version
+    app.register_blueprint(Api.bp, name='api_latest', url_prefix='/api')
+
+
+def commands(app):
+
+    @app.cli.command('reindex-images')
+    def reindex_images():
+        """Backfill the feed pagination keys on existing images."""
+        from app.classes.Database import Database
+        count = Database().reindex_images()
+        print('Reindexed {0} images'.format(count))
+
+    @app.cli.command('rebuild-like-counts')
+    def rebuild_like_counts():
+        """Recompute every image's like count from the users' likes."""
+        from app.classes.Database import Database
+        # Buffered likes would otherwise be counted twice or not at all
+        app.extensions['likes'].flush()
+        count = Database().rebuild_like_counts()
+        app.extensions['image_cache'].clear()
+        print('Corrected {0} like counts'.format(count))
+
+    @app.cli.command('build-hashes')
+    def build_hashes():
+        """Compute the perceptual hashes of images uploaded before they existed."""
+        from app.classes.Database import Database
+        from app.classes.Upload import Upload
+        database = Database()
+        uploader = Upload()
+        count = 0
+        for image_data in database.get_all_images():
+            if image_data.get('phash') or not image_data.get('upload_location'):
+                continue
+            database.update_image_fields(uploader.perceptual_hashes(image_data['upload_location']), image_data['id'])
+            count += 1
+        app.extensions['image_cache'].clear()
+        print('Hashed {0} images'.format(count))
+
+    @app.cli.command('build-derivatives')
+    def build_derivatives():
+        """Generate the responsive sizes and WebP/AVIF copies for images uploaded before they existed."""
+        from app.classes.Database import Database
+        from app.classes.Upload import Upload
+        database = Database()
+        uploader = Upload()
+        count = 0
+        for image_data in database.get_all_images():
+            if image_data.get('sizes') or not image_data.get('upload_location'):
+                continue
+            sizes = uploader.make_derivatives(image_data['upload_location'])
+            for size in sizes or [{"location": image_data['upload_location']}]:
+                uploader.transcode(size["location"])
+            database.update_image_fields({"sizes": sizes}, image_data['id'])
+            count += 1
+        app.extensions['image_cache'].clear()
+        print('Built derivatives for {0} images'.format(count))
@@ -0,0 +1,106 @@
+import os
+import re
+import hashlib
+import threading
+from flask import request, url_for
+
+class Assets():
+    """
+    Assets Class.
+
+    Fingerprints static files with a hash of their content, so their URLs
+    change whenever they do and can be cached by browsers forever. Also marks
+    content-addressed uploads and renditions as immutable.
+
+    """
+
+    # A year, the longest lifetime caches are expected to honour
+    immutable_max_age = 31536000
+
+    # Content-addressed uploads: static/uploads/<2 hex>/<sha256>...
+    content_addressed = re.compile(r'^([0-9a-f]{2})/\1[0-9a-f]{62}[.-]')
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.fingerprints = {}
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Registers the asset_url template global and the caching headers.
+        """
+        self.static_folder = app.static_folder
+        app.jinja_env.globals['asset_url'] = self.asset_url
+        app.after_request(self.cache_headers)
+        app.extensions['assets'] = self
+
+    def fingerprint(self, filename):
+        """
+        Get method.
+
+        Returns a short hash of a static file's content, recomputed only when
+        its modification time changes.
+        """
+        path = os.path.join(self.static_folder, filename)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self.fingerprints.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as asset:
+            for block in iter(lambda: asset.read(64 * 1024), b''):
+                digest.update(block)
+        with self.lock:
+            self.fingerprints[filename] = (mtime, digest.hexdigest()[:12])
+        return self.fingerprints[filename][1]
+
+    def asset_url(self, filename):
+        """
+        Template method.
+
+        Returns the fingerprinted URL of a static file, e.g. /static/css/style.css?v=1a2b3c4d5e6f.
+        """
+        fingerprint = self.fingerprint(filename)
+        if fingerprint is None:
+            return url_for('static', filename=filename)
+        return url_for('static', filename=filename, v=fingerprint)
+
+    def is_immutable(self, filename):
+        """
+        Check method.
+
+        Returns whether an upload path is content-addressed, i.e. can never change.
+        """
+        return bool(self.content_addressed.match(filename))
+
+    def cache_headers(self, response):
+        """
+        After request method.
+
+        Gives fingerprinted static files far-future immutable caching. Requests
+        with a stale fingerprint get the default revalidating headers, so an
+        old URL never pins new content.
+        """
+        if request.endpoint != 'static' or response.status_code not in (200, 206, 304):
+            return response
+        filename = request.view_args.get('filename', '')
+        version = request.args.get('v')
+        immutable = version and version == self.fingerprint(filename)
+        if not immutable and filename.startswith('uploads/'):
+            immutable = self.is_immutable(filename[len('uploads/'):])
+        if immutable:
+            response.cache_control.public = True
+            response.cache_control.max_age = self.immutable_max_age
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
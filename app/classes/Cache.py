@@ -0,0 +1,135 @@
+import os
+import threading
+from app.classes.CacheBackend import MemoryCacheBackend, SQLiteCacheBackend
+
+class Cache():
+    """
+    Cache Class.
+
+    Read-through cache for image listings and records. Entries are bounded in
+    number, expire after a TTL and are evicted least recently used first. Each
+    entry carries tags (e.g. the images it contains) so writes can invalidate
+    exactly the entries they affect. A value whose load started before an
+    invalidation is not stored, as it may predate the write.
+
+    Storage is delegated to a backend: "memory" keeps entries per process,
+    "sqlite" shares them between every worker on the host.
+
+    """
+
+    backends = {
+        "memory": lambda app: MemoryCacheBackend(app.config['IMAGE_CACHE_SIZE']),
+        "sqlite": lambda app: SQLiteCacheBackend(app.config['IMAGE_CACHE_PATH'], app.config['IMAGE_CACHE_SIZE']),
+    }
+
+    def __init__(self, app=None, backend=None, ttl=300):
+        """
+        Initialise class with configuration
+
+        """
+        self.backend = backend or MemoryCacheBackend()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the cache backend, size and TTL from the Flask app and registers the cache.
+        """
+        app.config.setdefault('IMAGE_CACHE_BACKEND', 'memory')
+        app.config.setdefault('IMAGE_CACHE_SIZE', 512)
+        app.config.setdefault('IMAGE_CACHE_TTL', self.ttl)
+        app.config.setdefault('IMAGE_CACHE_PATH', os.path.join(app.instance_path, 'cache.sqlite3'))
+        if app.config['IMAGE_CACHE_BACKEND'] not in self.backends:
+            raise Exception("Unknown cache backend: " + app.config['IMAGE_CACHE_BACKEND'])
+        self.backend = self.backends[app.config['IMAGE_CACHE_BACKEND']](app)
+        self.ttl = app.config['IMAGE_CACHE_TTL']
+        app.extensions['image_cache'] = self
+
+    def get_or_load(self, key, loader, tags=None):
+        """
+        Get method.
+
+        Returns the cached value for key, or calls loader and caches its result.
+        Tags may be a list or a function of the loaded value.
+        """
+        found, value = self.lookup(key)
+        if found:
+            return value
+        generation = self.generation()
+        return self.store(key, loader(), tags, generation)
+
+    def generation(self):
+        """
+        Get method.
+
+        Returns the backend's invalidation generation. Take it before loading
+        a value and pass it to store, which then skips values an invalidation
+        may have made stale while they loaded.
+        """
+        return self.backend.generation()
+
+    def lookup(self, key):
+        """
+        Get method.
+
+        Reads an entry from the backend and counts the hit or miss.
+        """
+        found, value = self.backend.get(key)
+        with self.lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found, value
+
+    def store(self, key, value, tags=None, generation=None):
+        """
+        Set method.
+
+        Caches a loaded value with its tags, unless an invalidation happened
+        since the given generation, and returns it.
+        """
+        if callable(tags):
+            tags = tags(value)
+        self.backend.set(key, value, tags or [], self.ttl, generation)
+        return value
+
+    def invalidate(self, *tags):
+        """
+        Invalidate method.
+
+        Drops every entry carrying any of the given tags.
+        """
+        self.backend.invalidate(tags)
+
+    def clear(self):
+        """
+        Clear method.
+
+        Drops every entry.
+        """
+        self.backend.clear()
+
+    def stats(self):
+        """
+        Stats method.
+
+        Returns this worker's hit/miss counters and the backend's size.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "ttl": self.ttl
+            }
+        stats.update(self.backend.stats())
+        stats["backend"] = type(self.backend).__name__
+        return stats
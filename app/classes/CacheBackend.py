@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class CacheBackend():
+    """
+    CacheBackend Class.
+
+    Storage interface used by the listing cache. Entries have a TTL, are
+    evicted least recently used first, and carry tags for invalidation.
+
+    Every invalidation moves the backend to a new generation. A value
+    loaded in an older generation may predate the write that invalidated
+    it, so set() skips it when given the generation its load started in.
+
+    """
+
+    def get(self, key):
+        """
+        Get method.
+
+        Returns a (found, value) pair.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, tags, ttl, generation=None):
+        """
+        Set method.
+
+        Stores a value with its tags for ttl seconds, unless the backend has
+        moved past the given generation since the value was loaded.
+        """
+        raise NotImplementedError
+
+    def generation(self):
+        """
+        Get method.
+
+        Returns the current generation, to pass to set() once the value is loaded.
+        """
+        raise NotImplementedError
+
+    def invalidate(self, tags):
+        """
+        Invalidate method.
+
+        Drops every entry carrying any of the given tags.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Clear method.
+
+        Drops every entry.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Stats method.
+
+        Returns the backend's size and eviction counts.
+        """
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    MemoryCacheBackend Class.
+
+    Per-process backend on an OrderedDict. Fastest, but every worker keeps
+    its own copy and only sees its own invalidations.
+
+    """
+
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.time():
+                self.remove(key)
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key, value, tags, ttl, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.invalidations:
+                return
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (time.time() + ttl, value, tags)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_size:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            for tag in entry[2]:
+                keys = self.tags.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.tags[tag]
+
+    def generation(self):
+        with self.lock:
+            return self.invalidations
+
+    def invalidate(self, tags):
+        with self.lock:
+            self.invalidations += 1
+            for tag in tags:
+                for key in list(self.tags.get(tag, ())):
+                    self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += 1
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "evictions": self.evictions}
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    SQLiteCacheBackend Class.
+
+    Host-wide backend on a shared SQLite file. Every worker process on the
+    host reads the same entries, so one invalidation, e.g. after an upload,
+    refreshes all of them and each listing is fetched from Firebase once.
+
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL);
+        CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+        CREATE TABLE IF NOT EXISTS tags (tag TEXT, key TEXT, PRIMARY KEY (tag, key));
+        CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+        CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER);
+    """
+
+    def __init__(self, path, max_size=512):
+        self.path = path
+        self.max_size = max_size
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connect() as connection:
+            connection.executescript(self.schema)
+
+    def connect(self):
+        """
+        Connect method.
+
+        Returns this thread's connection, reopening it after a fork so worker
+        processes never share a SQLite handle.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        connection = self.connect()
+        key = json.dumps(key)
+        row = connection.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        now = time.time()
+        if row[1] < now:
+            self.remove(connection, [key])
+            return False, None
+        connection.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return True, json.loads(row[0])
+
+    def set(self, key, value, tags, ttl, generation=None):
+        connection = self.connect()
+        key = json.dumps(key)
+        now = time.time()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if generation is not None and generation != self.current(connection):
+                return
+            connection.execute("DELETE FROM tags WHERE key = ?", (key,))
+            connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, json.dumps(value), now + ttl, now))
+            connection.executemany("INSERT OR IGNORE INTO tags VALUES (?, ?)", [(tag, key) for tag in tags])
+            overflow = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_size
+            if overflow > 0:
+                oldest = [row[0] for row in connection.execute("SELECT key FROM entries ORDER BY accessed LIMIT ?", (overflow,))]
+                self.remove(connection, oldest)
+                connection.execute("INSERT INTO counters VALUES ('evictions', ?) ON CONFLICT(name) DO UPDATE SET value = value + ?", (overflow, overflow))
+
+    def remove(self, connection, keys):
+        """
+        Remove method.
+
+        Drops entries and their tag rows.
+        """
+        connection.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+        connection.executemany("DELETE FROM tags WHERE key = ?", [(key,) for key in keys])
+
+    def current(self, connection):
+        """
+        Get method.
+
+        Returns the host-wide generation, shared by every worker.
+        """
+        row = connection.execute("SELECT value FROM counters WHERE name = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def advance(self, connection):
+        """
+        Update method.
+
+        Moves every worker to a new generation, so loads started before it are not stored.
+        """
+        connection.execute("INSERT INTO counters VALUES ('generation', 1) ON CONFLICT(name) DO UPDATE SET value = value + 1")
+
+    def generation(self):
+        return self.current(self.connect())
+
+    def invalidate(self, tags):
+        connection = self.connect()
+        tags = list(tags)
+        if not tags:
+            return
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self.advance(connection)
+            placeholders = ",".join("?" * len(tags))
+            keys = [row[0] for row in connection.execute("SELECT DISTINCT key FROM tags WHERE tag IN (" + placeholders + ")", tags)]
+            self.remove(connection, keys)
+
+    def clear(self):
+        connection = self.connect()
+        with connection:
+            self.advance(connection)
+            connection.execute("DELETE FROM entries")
+            connection.execute("DELETE FROM tags")
+
+    def stats(self):
+        connection = self.connect()
+        size = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        evictions = connection.execute("SELECT value FROM counters WHERE name = 'evictions'").fetchone()
+        return {"size": size, "evictions": evictions[0] if evictions else 0}
@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it, responses are only gzipped
+    brotli = None
+
+class Compression():
+    """
+    Compression Class.
+
+    Conditional, compressed representations for API responses. The body is
+    encoded with the best coding the client accepts (br, then gzip), once it
+    is worth it, and every representation gets a strong ETag of its content
+    and coding, so a client revalidating with If-None-Match gets a 304
+    without the body being compressed again.
+
+    """
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.min_bytes = 512
+        self.level = 6
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the compression threshold and level from the Flask app and registers the extension.
+        """
+        app.config.setdefault('COMPRESS_MIN_BYTES', self.min_bytes)
+        app.config.setdefault('COMPRESS_LEVEL', self.level)
+        self.min_bytes = app.config['COMPRESS_MIN_BYTES']
+        self.level = app.config['COMPRESS_LEVEL']
+        app.extensions['compression'] = self
+
+    def codings(self):
+        """
+        Get method.
+
+        Returns the codings available in this process, best first.
+        """
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def negotiate(self, size):
+        """
+        Get method.
+
+        Returns the coding to use for a body of the given size, or None to send it as is.
+        """
+        if size < self.min_bytes:
+            return None
+        for coding in self.codings():
+            if request.accept_encodings[coding]:
+                return coding
+        return None
+
+    def encode(self, data, coding):
+        """
+        Encode method.
+
+        Compresses a body with the given coding.
+        """
+        if coding == 'br':
+            return brotli.compress(data, quality=min(self.level, 11))
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def represent(self, response):
+        """
+        Response method.
+
+        Adds the validators to a successful response, answers it with a 304
+        when the client's copy is current, and compresses it otherwise.
+        """
+        if response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+        data = response.get_data()
+        coding = self.negotiate(len(data))
+        response.vary.add('Accept-Encoding')
+        response.set_etag(hashlib.sha1(data).hexdigest() + ('-' + coding if coding else ''))
+        response.make_conditional(request)
+        if response.status_code == 304 or coding is None:
+            return response
+        response.set_data(self.encode(data, coding))
+        response.headers['Content-Encoding'] = coding
+        return response
@@ -1,11 +1,12 @@
-import os
-import tempfile
-import pyrebase
-import requests
+import logging
 import json
+import base64
+import time
 from collections import OrderedDict
 from flask import current_app as flask_app
-from app import SITE_ROOT
+from app.classes.Logging import Payload
+
+logger = logging.getLogger(__name__)
 
 class Database():
     """ 
@@ -20,13 +21,8 @@ class Database():
         Initialise class with configuration 
     
         """
-        # Load Firebase config data, including Service Account file
-        firebase_config_file = os.path.join(SITE_ROOT, 'firebase.json')
-        firebase_config = json.load(open(firebase_config_file))
-        firebase_config["serviceAccount"] = os.path.join(SITE_ROOT, 'firebase.admin.json')
-        
-        # Initialize Firebase auth and database
-        self.firebase = pyrebase.initialize_app(firebase_config)
+        # Reuse the process-wide Firebase client registered in create_app
+        self.firebase = flask_app.extensions['firebase']
         self.auth = self.firebase.auth()
         self.db = self.firebase.database()
 
@@ -40,55 +36,259 @@ class Database():
         }
 
     # Image Requests
-    def get_images(self, limit=20, user_id=False):
+    def get_images(self, limit=20, user_id=False, cursor=None):
         """
         Get method.
 
-        Requests to fetch a maximum of 20 images from the DB.
+        Requests a page of images from the DB, newest first, starting after the cursor.
         """
         
         try:
             if (user_id):
-                # Attempts to fetch images and display them in order of userID.
-                images = self.db.child("images").order_by_child("user_id").equal_to(user_id).limit_to_first(limit).get()
+                # Attempts to fetch the user's images in upload order.
+                images, next_cursor = self.get_feed("user_key", user_id + "/", limit, cursor)
             else:
-                images = self.db.child("images").order_by_child("user_id").limit_to_first(limit).get()
+                images, next_cursor = self.get_feed("sort_key", "", limit, cursor)
             
-            # Returns the maximum of 20 images in order of image value.
-            flask_app.logger.info('####################### images val #####################')
-            flask_app.logger.info(images.val())
-            if isinstance(images.val(), OrderedDict):
-                # Return on success
-                return images
-            else:
-                # Fails to return images due to process errors.
-                return False
+            # Returns the page of images in upload order.
+            logger.debug('Fetched images: %s', Payload(images))
+            return images, next_cursor
             
         except Exception as err:
             # Raise error upon failed fetch request.
             self.process_error(err)
 
-    def get_category_images(self, category, limit=20):
+    def get_category_images(self, category, limit=20, cursor=None):
         """
         Get method.
 
-        Attempts to retrieve a maximum of 20 images in a selected catergory from the DB.
+        Attempts to retrieve a page of images in a selected catergory from the DB.
         """
         try:
-            # Displays images in order of catergory 
-            images = self.db.child("images").order_by_child("category").equal_to(category).limit_to_first(limit).get()
-
-            if isinstance(images.val(), OrderedDict):
-                # Returns images upon success.
-                return images
-            else:
-                # Fails to return images in catergory due to error(s).
-                return False
+            # Displays images in the catergory in upload order
+            return self.get_feed("category_key", category + "/", limit, cursor)
             
         except Exception as err:
             # Raise error due to process errors.
             self.process_error(err)
+
+    def get_feed(self, index, prefix, limit, cursor=None):
+        """
+        Get method.
+
+        Keyset pagination over one of the feed index fields. Records are read
+        newest first, ending just before the cursor, so each page only
+        transfers limit + 2 records however large the images node is.
+        """
+        end = self.feed_end(prefix, cursor)
+        replica = self.get_replica()
+        if replica:
+            # One extra record detects a further page, one more covers the cursor record itself
+            records = replica.get_feed(index, prefix, end, limit + 2)
+        else:
+            query = self.db.child("images").order_by_child(index)
+            if prefix:
+                query = query.start_at(prefix)
+            images = query.end_at(end).limit_to_last(limit + 2).get()
+
+            if not isinstance(images.val(), OrderedDict):
+                # No images in this feed
+                return [], None
+            records = [image.val() for image in reversed(images.each())]
+
+        return self.feed_page(records, index, end, limit, cursor)
+
+    def feed_end(self, prefix, cursor):
+        """
+        Pagination method.
+
+        Returns the highest index value a feed page may include: just the cursor, or the end of the prefix.
+        """
+        return prefix + (self.decode_cursor(cursor) if cursor else "\uf8ff")
+
+    def feed_page(self, records, index, end, limit, cursor):
+        """
+        Pagination method.
+
+        Turns the up to limit + 2 records read for a page, newest first, into
+        the page and the cursor for the next one.
+        """
+        # Partial records, e.g. a like count written after its image was deleted, are not in any feed
+        records = [record for record in records if isinstance(record, dict) and index in record]
+        if not records:
+            return [], None
+        if cursor:
+            records = [record for record in records if record[index] < end]
+
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = self.encode_cursor(records[-1]["sort_key"])
+        return records, next_cursor
+
+    def get_all_images(self):
+        """
+        Get method.
+
+        Requests every image record from the DB, for bulk jobs and index builds.
+        """
+        try:
+            replica = self.get_replica()
+            if replica:
+                return replica.get_all_images()
+            images = self.db.child("images").get()
+            if not isinstance(images.val(), OrderedDict):
+                return []
+            return [image.val() for image in images.each() if isinstance(image.val(), dict) and "id" in image.val()]
+        except Exception as err:
+            # Raise error upon failed fetch request.
+            self.process_error(err)
+
+    def existing_images(self, image_ids):
+        """
+        Get method.
+
+        Returns which of the given image IDs have a stored record, with one
+        shallow read of the image keys. A partial record left by an earlier
+        increment counts as existing, and is removed by rebuild_like_counts.
+        """
+        image_ids = set(image_ids)
+        if not image_ids:
+            return set()
+        try:
+            stored = self.db.child("images").shallow().get().val() or ()
+            return image_ids.intersection(stored)
+        except Exception as err:
+            # Raise error upon failed fetch request.
+            self.process_error(err)
+
+    def get_popular_images(self, limit=20):
+        """
+        Get method.
+
+        Requests the most liked images from the DB, most liked first, using the like_count index.
+        """
+        try:
+            images = self.db.child("images").order_by_child("like_count").start_at(1).limit_to_last(limit).get()
+            if not isinstance(images.val(), OrderedDict):
+                return []
+            return [image.val() for image in reversed(images.each()) if "id" in image.val()]
+        except Exception as err:
+            # Raise error upon failed fetch request.
+            self.process_error(err)
+
+    def get_replica(self):
+        """
+        Get method.
+
+        Returns the local replica when it is enabled and up to date, otherwise None.
+        """
+        replica = flask_app.extensions.get('replica')
+        if replica is not None and replica.is_ready():
+            return replica
+        return None
+
+    def wrote(self, image_id):
+        """
+        Update method.
+
+        Tells the replica an image was just written, so reads of it by this user go to Firebase for a while.
+        """
+        replica = flask_app.extensions.get('replica')
+        if replica is not None:
+            replica.wrote(image_id)
+
+    def encode_cursor(self, sort_key):
+        """
+        Encode method.
+
+        Turns a record's sort key into an opaque, URL-safe cursor.
+        """
+        return base64.urlsafe_b64encode(sort_key.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        """
+        Decode method.
+
+        Turns a cursor back into the sort key it was created from.
+        """
+        try:
+            padding = "=" * (-len(cursor) % 4)
+            return base64.urlsafe_b64decode((cursor + padding).encode()).decode()
+        except Exception:
+            raise Exception("This page link is no longer valid.")
+
+    def feed_keys(self, image_data):
+        """
+        Index method.
+
+        Adds the composite keys the feeds are ordered by. The created_at and id
+        pair is unique and stable, so it can be used as a pagination cursor.
+        """
+        sort_key = "{0:012d}_{1}".format(int(image_data["created_at"]), image_data["id"])
+        image_data["sort_key"] = sort_key
+        image_data["category_key"] = image_data["category"] + "/" + sort_key
+        image_data["user_key"] = str(image_data["user_id"]) + "/" + sort_key
+        return image_data
+
+    def versioned(self, image_data):
+        """
+        Index method.
+
+        Stamps a write with the time it was made, in milliseconds. The
+        updated_at stamp versions the record, e.g. for its cached grid tile.
+        """
+        image_data["updated_at"] = int(time.time() * 1000)
+        return image_data
+
+    def reindex_images(self):
+        """
+        Index method.
+
+        Backfills the feed keys on every stored image, for records saved before
+        the feeds were paginated. Returns the number of records updated.
+        """
+        updates = {}
+        for image_data in self.get_all_images():
+            image_data = self.feed_keys(image_data)
+            for key in ("sort_key", "category_key", "user_key"):
+                updates[image_data["id"] + "/" + key] = image_data[key]
+        if updates:
+            self.db.child("images").update(updates)
+        return len(updates) // 3
         
+    def rebuild_like_counts(self):
+        """
+        Index method.
+
+        Recomputes every image's like_count from the likes in the user
+        records, e.g. after a failed flush or for images liked before the
+        counts existed. Counters left behind for deleted images are removed.
+        Returns the number of counts that changed.
+        """
+        counts = {}
+        users = self.db.child("users").get().val() or {}
+        for user in users.values():
+            likes = user.get("likes") or []
+            if isinstance(likes, dict):
+                likes = [image_id for image_id, liked in likes.items() if liked]
+            for image_id in likes:
+                counts[image_id] = counts.get(image_id, 0) + 1
+
+        updates = {}
+        images = self.db.child("images").get()
+        if isinstance(images.val(), OrderedDict):
+            for image in images.each():
+                image_data = image.val()
+                if "id" not in image_data:
+                    # Only a counter: the image was deleted while likes were buffered
+                    updates[image.key()] = None
+                elif image_data.get("like_count", 0) != counts.get(image.key(), 0):
+                    updates[image.key() + "/like_count"] = counts.get(image.key(), 0)
+        if updates:
+            self.db.child("images").update(updates)
+        return len(updates)
+
     def get_image(self, image_id):
         """
         Get method.
@@ -100,12 +300,18 @@ class Database():
         image = False
         
         try:
-            # Tries to display images with that specific ID.
+            replica = self.get_replica()
+            if replica and replica.is_current(image_id):
+                # Reads the local mirror when it is up to date.
+                image = replica.get_image(image_id)
+                if image is not None:
+                    return image
+            # Tries to display images with that specific ID, e.g. one the mirror has not received yet.
             image = self.db.child("images").child(image_id).get()
 
         except Exception as err:
             # Checks if flask causes the error and raises an error if true.
-            flask_app.logger.info(err)
+            logger.info('Could not fetch image %s: %s', image_id, err)
             error = err
 
         if error:
@@ -122,8 +328,37 @@ class Database():
         Stores the image data under the corresponding imageID in the DB.
         """
         try:
-            # Sets the image data corresponding to the imageID in the DB. 
-            self.db.child("images").child(image_id).set(image_data)
+            # Sets the image data corresponding to the imageID in the DB, along with its feed keys.
+            self.db.child("images").child(image_id).set(self.versioned(self.feed_keys(image_data)))
+            self.wrote(image_id)
+        except Exception as err:
+            # Raises error due to proccess error(s).
+            self.process_error(err)
+
+    def update_image(self, image_data, image_id):
+        """
+        Update method.
+
+        Updates the edited fields of an image in the DB, keeping fields the form does not carry (e.g. its sizes).
+        """
+        try:
+            # Updates the image data corresponding to the imageID in the DB, along with its feed keys.
+            self.db.child("images").child(image_id).update(self.versioned(self.feed_keys(image_data)))
+            self.wrote(image_id)
+        except Exception as err:
+            # Raises error due to proccess error(s).
+            self.process_error(err)
+
+    def update_image_fields(self, fields, image_id):
+        """
+        Update method.
+
+        Updates only the given fields of an image in the DB, and returns them with their version.
+        """
+        try:
+            self.db.child("images").child(image_id).update(self.versioned(fields))
+            self.wrote(image_id)
+            return fields
         except Exception as err:
             # Raises error due to proccess error(s).
             self.process_error(err)
@@ -137,10 +372,61 @@ class Database():
         try:
             # Fetches and removes the image ID from the DB. 
             self.db.child("images").child(image_id).remove()
+            self.wrote(image_id)
         except Exception as err:
             # Raises error upon process failure.
             self.process_error(err)
 
+    def retain_blob(self, digest, location):
+        """
+        Update method.
+
+        Adds a reference to a content-addressed upload, using a server-side
+        increment so concurrent uploads of the same file cannot lose a count.
+        """
+        try:
+            self.db.child("blobs").child(digest).update({"refs": {".sv": {"increment": 1}}, "location": location})
+        except Exception as err:
+            # Raises error due to proccess error(s).
+            self.process_error(err)
+
+    def release_blob(self, digest):
+        """
+        Update method.
+
+        Drops a reference to a content-addressed upload. Returns True when that
+        was the last reference, in which case the blob record is removed and the
+        caller should unlink the file (see Upload.remove_blob).
+
+        The record is only removed if it is unchanged since its count was
+        read, so an upload of the same content retaining it in between keeps it.
+        """
+        try:
+            self.db.child("blobs").child(digest).update({"refs": {".sv": {"increment": -1}}})
+            found = self.db.child("blobs").child(digest).get_etag()
+            while found["value"] is not None and (found["value"].get("refs") or 0) <= 0:
+                conflict = self.db.child("blobs").child(digest).conditional_remove(found["ETag"])
+                if not conflict:
+                    return True
+                # Changed since it was read: look at the count again
+                found = conflict
+            return False
+        except Exception as err:
+            # Raises error due to proccess error(s).
+            self.process_error(err)
+
+    def blob_retained(self, digest):
+        """
+        Get method.
+
+        Returns whether any image or avatar references a content-addressed upload.
+        """
+        try:
+            return (self.db.child("blobs").child(digest).child("refs").get().val() or 0) > 0
+        except Exception as err:
+            # Raises error due to proccess error(s).
+            self.process_error(err)
+
     def remove_matching_value(self, data, value):
         """
         Remove method.
@@ -191,24 +477,79 @@ class Database():
         Attempts to update the user's information in relation to their ID in the DB.
         """
         try:
+            # Likes are written one node at a time by the like buffer, so they are left out of profile updates
+            profile = {key: value for key, value in user_data.items() if key != 'likes'}
             # Uses the localID to update the user's corresponding information as entered by the user.
-            self.db.child("users").child(user_data['localId']).update(user_data)
+            self.db.child("users").child(user_data['localId']).update(profile)
             # Returns the updated profile upon successful request to the DB.
             return
         except Exception as err:
             # Raises an error if there is a process failure during the request.
             self.process_error(err)
 
+    def set_likes(self, user_id, likes):
+        """
+        Update method.
+
+        Replaces a user's likes with one node per liked image, e.g. to convert
+        the list older accounts stored.
+        """
+        try:
+            self.db.child("users").child(user_id).child("likes").set({image_id: True for image_id in likes} or None)
+        except Exception as err:
+            self.process_error(err)
+
+    def update_paths(self, updates):
+        """
+        Update method.
+
+        Writes several locations in one atomic multi-path update, keyed by path from the root.
+        """
+        try:
+            self.db.update(updates)
+        except Exception as err:
+            self.process_error(err)
+
+    @staticmethod
+    def valid_key(key):
+        """
+        Check method.
+
+        Returns whether a string may be used as a key in the DB: 1 to 768
+        bytes, without ".", "#", "$", "[", "]", "/" or control characters.
+        """
+        return (isinstance(key, str) and 0 < len(key.encode('utf-8')) <= 768 and
+                not any(char in '.#$[]/' or ord(char) < 32 or ord(char) == 127 for char in key))
+
+    def status_code(self, error):
+        """
+        Check method.
+
+        Returns the HTTP status Firebase answered a failed request with, or None if there was no response.
+        """
+        while error is not None:
+            response = getattr(error, 'response', None)
+            if response is None and error.args:
+                response = getattr(error.args[0], 'response', None)
+            if response is not None:
+                return response.status_code
+            error = error.__cause__
+        return None
+
     # Processes the error and finds the cause of the error. Once the cause is found, a readable error is presented.
     def process_error(self, error):
-        flask_app.logger.info(error)
+        logger.info('Firebase request failed: %s', error)
         readable_error = self.get_readable_error(error)
-        raise Exception(readable_error)
+        raise Exception(readable_error) from error
 
     # Fetches readable error message for the user, if error cause is undefinable: present "there was a problem with your request."
     def get_readable_error(self, error):
-        error_json = error.args[1]
-        error_messsage = json.loads(error_json)['error']['message']
+        try:
+            error_json = error.args[1]
+            error_messsage = json.loads(error_json)['error']['message']
+        except (IndexError, TypeError, KeyError, ValueError):
+            # Not an error response from Firebase Auth, e.g. a database rule or connection failure
+            return "There was a problem with your request."
         if error_messsage in self.readable_errors.keys(): 
             return self.readable_errors[error_messsage]
         else: 
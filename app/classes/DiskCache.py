@@ -0,0 +1,93 @@
+import os
+import tempfile
+import threading
+
+class DiskCache():
+    """
+    DiskCache Class.
+
+    Directory of generated files bounded by total size. Files are touched on
+    every hit, so when the directory grows past max_bytes the least recently
+    used files are deleted first.
+
+    """
+
+    def __init__(self, directory, max_bytes):
+        """
+        Initialise class with configuration
+
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def path(self, name):
+        """
+        Get method.
+
+        Returns the path a cached file is stored at.
+        """
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        """
+        Get method.
+
+        Returns the path of a cached file, marking it recently used, or None on a miss.
+        """
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_create(self, name, create):
+        """
+        Get method.
+
+        Returns the path of a cached file, calling create(path) to write it on a miss.
+        The file is written to a temporary name first so readers never see half a file.
+        """
+        path = self.get(name)
+        if path is not None:
+            return path
+        path = self.path(name)
+        handle, temporary = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        os.close(handle)
+        try:
+            create(temporary)
+            os.replace(temporary, path)
+        except Exception:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        with self.lock:
+            self.total_bytes += os.path.getsize(path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Evict method.
+
+        Deletes the least recently used files until the cache fits in max_bytes.
+        """
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            entries = [entry for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.startswith('.tmp-')]
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            # Other workers share the directory, so recount rather than trust the running total
+            self.total_bytes = sum(entry.stat().st_size for entry in entries)
+            for entry in entries:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    self.total_bytes -= size
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,137 @@
+import os
+import json
+import threading
+import pyrebase
+from requests.adapters import HTTPAdapter
+from oauth2client.service_account import ServiceAccountCredentials
+from app import SITE_ROOT
+
+class Credentials():
+    """
+    Credentials Class.
+
+    Wraps the Firebase service account so the key file is only read, and the
+    access token only refreshed, when a request actually needs it.
+
+    """
+
+    scopes = [
+        'https://www.googleapis.com/auth/firebase.database',
+        'https://www.googleapis.com/auth/userinfo.email',
+        'https://www.googleapis.com/auth/cloud-platform'
+    ]
+
+    def __init__(self, service_account):
+        self.service_account = service_account
+        self.credentials = None
+        self.lock = threading.Lock()
+
+    def get_access_token(self):
+        """
+        Get method.
+
+        Loads the service account on first use and returns a valid access token,
+        refreshing it under a lock so concurrent requests only refresh once.
+        """
+        with self.lock:
+            if self.credentials is None:
+                self.credentials = ServiceAccountCredentials.from_json_keyfile_name(self.service_account, self.scopes)
+            return self.credentials.get_access_token()
+
+
+class Firebase():
+    """
+    Firebase Class.
+
+    Process-wide registry holding a single initialised pyrebase app, shared
+    across requests. The app owns one keep-alive HTTP session, so every
+    Database instance reuses the same connection pool instead of opening new ones.
+
+    """
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.app = None
+        self.firebase = None
+        self.pool_size = 10
+        self.max_retries = 3
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the pool configuration from the Flask app and registers the client.
+        """
+        app.config.setdefault('FIREBASE_POOL_SIZE', 10)
+        app.config.setdefault('FIREBASE_MAX_RETRIES', 3)
+        self.pool_size = app.config['FIREBASE_POOL_SIZE']
+        self.max_retries = app.config['FIREBASE_MAX_RETRIES']
+        self.app = app
+        app.extensions['firebase'] = self
+
+    def get_app(self):
+        """
+        Get method.
+
+        Returns the shared pyrebase app, initialising it on first use.
+        """
+        if self.firebase is None:
+            with self.lock:
+                if self.firebase is None:
+                    self.use(self.initialize())
+        return self.firebase
+
+    def use(self, firebase):
+        """
+        Set method.
+
+        Makes a pyrebase app the shared one, timing the requests of its session when metrics are enabled.
+        """
+        metrics = self.app.extensions.get('metrics') if self.app is not None else None
+        if metrics is not None:
+            metrics.instrument_session(firebase.requests)
+        self.firebase = firebase
+
+    def initialize(self):
+        """
+        Initialise method.
+
+        Loads the Firebase config once and mounts a pooled adapter on the shared session.
+        """
+        # Load Firebase config data, leaving the Service Account to be loaded lazily
+        firebase_config_file = os.path.join(SITE_ROOT, 'firebase.json')
+        with open(firebase_config_file) as config_file:
+            firebase_config = json.load(config_file)
+        firebase_config.pop("serviceAccount", None)
+
+        firebase = pyrebase.initialize_app(firebase_config)
+        firebase.credentials = Credentials(os.path.join(SITE_ROOT, 'firebase.admin.json'))
+
+        # Keep-alive connection pool shared by every request
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=self.max_retries)
+        for scheme in ('http://', 'https://'):
+            firebase.requests.mount(scheme, adapter)
+        return firebase
+
+    def auth(self):
+        """
+        Get method.
+
+        Returns a new auth service bound to the shared session.
+        """
+        return self.get_app().auth()
+
+    def database(self):
+        """
+        Get method.
+
+        Returns a new database reference bound to the shared session. Query
+        builders are stateful, so each caller gets its own reference.
+        """
+        return self.get_app().database()
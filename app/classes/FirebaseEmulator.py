@@ -0,0 +1,355 @@
+import json
+import time
+import hashlib
+import uuid
+import random
+import threading
+from urllib.parse import urlsplit, parse_qsl
+import pyrebase
+import requests
+from requests.adapters import BaseAdapter
+from pyrebase.pyrebase import Auth, raise_detailed_error
+
+class EmulatorStore():
+    """
+    EmulatorStore Class.
+
+    In-memory JSON tree standing in for the Realtime Database, with the
+    subset of the REST API pyrebase uses: reads with
+    orderBy/startAt/endAt/equalTo/limitToFirst/limitToLast/shallow, and
+    put, patch (including multi-path updates), post and delete, with the
+    increment and timestamp server values and ETag conditional writes. Also
+    holds the emulated accounts.
+
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.accounts = {}
+        self.lock = threading.RLock()
+
+    def node(self, parts):
+        """
+        Get method.
+
+        Returns the value at a path, or None.
+        """
+        value = self.data
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                return None
+            value = value[part]
+        return value
+
+    def resolve(self, value, current):
+        """
+        Write method.
+
+        Replaces server values with what the server would store, and drops nulls.
+        """
+        if isinstance(value, dict):
+            server_value = value.get(".sv")
+            if server_value == "timestamp":
+                return int(time.time() * 1000)
+            if isinstance(server_value, dict) and "increment" in server_value:
+                return (current if isinstance(current, (int, float)) else 0) + server_value["increment"]
+            resolved = {}
+            for key, child in value.items():
+                child = self.resolve(child, current.get(key) if isinstance(current, dict) else None)
+                if child is not None and child != {}:
+                    resolved[key] = child
+            return resolved or None
+        return value
+
+    def put(self, path, value):
+        """
+        Write method.
+
+        Replaces the value at a path, removing it for null, and prunes parents left empty.
+        """
+        parts = [part for part in path.split('/') if part]
+        with self.lock:
+            value = self.resolve(value, self.node(parts))
+            if not parts:
+                self.data = value or {}
+                return
+            parent = self.data
+            parents = []
+            for part in parts[:-1]:
+                if not isinstance(parent.get(part), dict):
+                    if value is None:
+                        return
+                    parent[part] = {}
+                parents.append((parent, part))
+                parent = parent[part]
+            if value is None:
+                parent.pop(parts[-1], None)
+                for container, key in reversed(parents):
+                    if container[key]:
+                        break
+                    del container[key]
+            else:
+                parent[parts[-1]] = value
+
+    def patch(self, path, values):
+        """
+        Write method.
+
+        Writes each child of an update, whose keys may be paths themselves.
+        """
+        with self.lock:
+            for key, value in values.items():
+                self.put(path.rstrip('/') + '/' + key, value)
+
+    def query(self, path, params):
+        """
+        Read method.
+
+        Returns the value at a path, filtered and limited like the REST API.
+        """
+        parts = [part for part in path.split('/') if part]
+        with self.lock:
+            value = json.loads(json.dumps(self.node(parts)))
+        if not isinstance(value, dict):
+            return value
+        if params.get("shallow"):
+            return {key: True if isinstance(child, dict) else child for key, child in value.items()}
+        order = params.get("orderBy")
+        if not order:
+            return value
+
+        def sort_value(item):
+            key, child = item
+            if order == "$key":
+                return key
+            if order == "$value":
+                return child
+            return child.get(order) if isinstance(child, dict) else None
+
+        def position(found):
+            # Firebase orders nulls, false, true, numbers, strings, then objects
+            if found is None:
+                return (0, 0)
+            if isinstance(found, bool):
+                return (1, int(found))
+            if isinstance(found, (int, float)):
+                return (2, found)
+            if isinstance(found, str):
+                return (3, found)
+            return (4, 0)
+
+        def rank(item):
+            # Ties are ordered by key
+            return position(sort_value(item)) + (item[0],)
+
+        items = sorted(value.items(), key=rank)
+        for name, keep in (("equalTo", lambda found, bound: found == bound),
+                           ("startAt", lambda found, bound: found >= bound),
+                           ("endAt", lambda found, bound: found <= bound)):
+            if name in params:
+                bound = position(params[name])
+                items = [item for item in items if keep(rank(item)[:2], bound)]
+        if "limitToFirst" in params:
+            items = items[:params["limitToFirst"]]
+        if "limitToLast" in params:
+            items = items[-params["limitToLast"]:] if params["limitToLast"] else []
+        return dict(items)
+
+    def etag(self, path):
+        """
+        Get method.
+
+        Returns the ETag of the value at a path.
+        """
+        with self.lock:
+            value = self.node([part for part in path.split('/') if part])
+            return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+    def handle(self, method, url, body, headers=None):
+        """
+        Request method.
+
+        Serves one REST request and returns (status, JSON body, response
+        headers). Reads asked for with X-Firebase-ETag get the value's ETag,
+        and writes with if-match only go through if it is still current.
+        """
+        with self.lock:
+            return self.dispatch(method, url, body, headers or {})
+
+    def dispatch(self, method, url, body, headers):
+        """
+        Request method.
+
+        Serves one REST request, with the store locked so conditional writes are atomic.
+        """
+        parts = urlsplit(url)
+        path = parts.path
+        params = {}
+        for key, value in parse_qsl(parts.query):
+            if key in ("auth", "access_token"):
+                continue
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+
+        if path.startswith('/identitytoolkit/'):
+            return self.account(path.rsplit('/', 1)[-1], json.loads(body or '{}')) + ({},)
+        if not path.endswith('.json'):
+            return 404, {"error": "Not found"}, {}
+        path = path[:-len('.json')]
+        data = json.loads(body) if body else None
+        headers = {key.lower(): value for key, value in headers.items()}
+
+        if headers.get('if-match') and headers['if-match'] != self.etag(path):
+            return 412, self.query(path, {}), {"ETag": self.etag(path)}
+        if method == 'GET':
+            return 200, self.query(path, params), {"ETag": self.etag(path)} if headers.get('x-firebase-etag') == 'true' else {}
+        if method == 'PUT':
+            self.put(path, data)
+            return 200, data, {}
+        if method == 'PATCH':
+            self.patch(path, data or {})
+            return 200, data, {}
+        if method == 'POST':
+            key = '-' + uuid.uuid4().hex[:19]
+            self.put(path.rstrip('/') + '/' + key, data)
+            return 200, {"name": key}, {}
+        if method == 'DELETE':
+            self.put(path, None)
+            return 200, None, {}
+        return 405, {"error": "Method not allowed"}, {}
+
+    def account(self, action, payload):
+        """
+        Auth method.
+
+        Serves the sign up and sign in endpoints, with the error messages Firebase Auth uses.
+        """
+        email = payload.get("email", "")
+        with self.lock:
+            if action == 'signupNewUser':
+                if email in self.accounts:
+                    return 400, {"error": {"code": 400, "message": "EMAIL_EXISTS"}}
+                self.accounts[email] = {"localId": uuid.uuid4().hex[:28], "password": payload.get("password")}
+            elif action == 'verifyPassword':
+                if email not in self.accounts:
+                    return 400, {"error": {"code": 400, "message": "EMAIL_NOT_FOUND"}}
+                if self.accounts[email]["password"] != payload.get("password"):
+                    return 400, {"error": {"code": 400, "message": "INVALID_PASSWORD"}}
+            else:
+                return 404, {"error": {"code": 404, "message": "NOT_FOUND"}}
+            local_id = self.accounts[email]["localId"]
+        return 200, {"localId": local_id, "email": email, "idToken": "emulator-" + local_id,
+                     "refreshToken": "emulator", "expiresIn": "3600"}
+
+
+class EmulatorAdapter(BaseAdapter):
+    """
+    EmulatorAdapter Class.
+
+    requests transport serving the emulator's URLs from the store, after the
+    configured latency, so the real pyrebase request and error handling runs.
+
+    """
+
+    def __init__(self, emulator):
+        super().__init__()
+        self.emulator = emulator
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        time.sleep(self.emulator.delay())
+        body = request.body.decode() if isinstance(request.body, bytes) else request.body
+        status, payload, headers = self.emulator.store.handle(request.method, request.url, body, request.headers)
+        response = requests.Response()
+        response.status_code = status
+        response.reason = 'OK' if status < 400 else 'Error'
+        response._content = json.dumps(payload).encode()
+        response.headers['Content-Type'] = 'application/json; charset=utf-8'
+        response.headers.update(headers)
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class EmulatorAuth(Auth):
+    """
+    EmulatorAuth Class.
+
+    pyrebase's Auth posts to the Google endpoints directly rather than
+    through the shared session, so the calls the app uses are sent to the
+    emulator instead.
+
+    """
+
+    def post(self, action, payload):
+        request_ref = "{0}identitytoolkit/v3/relyingparty/{1}?key={2}".format(FirebaseEmulator.url, action, self.api_key)
+        headers = {"content-type": "application/json; charset=UTF-8"}
+        request_object = self.requests.post(request_ref, headers=headers, data=json.dumps(payload))
+        raise_detailed_error(request_object)
+        return request_object.json()
+
+    def sign_in_with_email_and_password(self, email, password):
+        self.current_user = self.post("verifyPassword", {"email": email, "password": password, "returnSecureToken": True})
+        return self.current_user
+
+    def create_user_with_email_and_password(self, email, password):
+        return self.post("signupNewUser", {"email": email, "password": password, "returnSecureToken": True})
+
+
+class FirebaseEmulator():
+    """
+    FirebaseEmulator Class.
+
+    Local stand-in for the Firebase Realtime Database and Auth, so the app
+    runs, and can be load tested, without firebase.json, the service account
+    or Google's endpoints. pyrebase keeps building real REST requests; only
+    the transport under it is swapped for one served from an in-memory
+    store. Every request waits `latency` seconds, plus up
+    to `jitter`, to stand in for the round-trip to Firebase.
+
+    Streaming is not emulated, so the replica cannot be used with it.
+
+    """
+
+    url = "http://firebase.emulator/"
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.store = EmulatorStore()
+        self.latency = 0.0
+        self.jitter = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the injected latency from the Flask app and points the Firebase clients at the emulator.
+        """
+        app.config.setdefault('FIREBASE_EMULATOR_LATENCY', 0.0)
+        app.config.setdefault('FIREBASE_EMULATOR_JITTER', 0.0)
+        self.latency = app.config['FIREBASE_EMULATOR_LATENCY']
+        self.jitter = app.config['FIREBASE_EMULATOR_JITTER']
+
+        firebase = pyrebase.initialize_app({"apiKey": "emulator", "authDomain": "emulator", "databaseURL": self.url, "storageBucket": ""})
+        firebase.requests.mount(self.url, EmulatorAdapter(self))
+        firebase.auth = lambda: EmulatorAuth(firebase.api_key, firebase.requests, firebase.credentials)
+        app.extensions['firebase'].use(firebase)
+        app.extensions['firebase_emulator'] = self
+
+    def delay(self):
+        """
+        Latency method.
+
+        Returns how long the next request waits.
+        """
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
@@ -0,0 +1,111 @@
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+
+class Fragments():
+    """
+    Fragments Class.
+
+    Per-process cache of rendered grid tiles. A tile is rendered once per
+    image version (its updated_at stamp, or created_at for records written
+    before it existed), with markers standing in for the parts that differ
+    per request: whether the current user likes the image, and its like
+    count. Later requests only join the cached parts around those two
+    values, instead of rendering the tile again.
+
+    """
+
+    # Private use characters, which the template itself never contains
+    liked_marker = '\ue000'
+    count_marker = '\ue001'
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.tiles = OrderedDict()
+        self.size = 2000
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the cache size from the Flask app and registers the tile template global.
+        """
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', self.size)
+        self.size = app.config['FRAGMENT_CACHE_SIZE']
+        self.app = app
+        app.jinja_env.globals['tile'] = self.tile
+        app.extensions['fragments'] = self
+
+    def tile(self, image, liked):
+        """
+        Render method.
+
+        Returns the grid tile for an image, as the current user sees it.
+        """
+        liked_class = 'fas' if liked else 'far'
+        like_count = str(int(image.get("like_count") or 0))
+        parts = self.parts(image)
+        if parts is None:
+            return Markup(self.render(image, liked_class, like_count))
+        return Markup(parts[0] + liked_class + parts[1] + like_count + parts[2])
+
+    def parts(self, image):
+        """
+        Get method.
+
+        Returns the cached parts of an image's tile, rendering them on a miss,
+        or None for a record containing the markers itself.
+        """
+        key = (image["id"], image.get("updated_at") or image.get("created_at"))
+        with self.lock:
+            parts = self.tiles.get(key)
+            if parts is not None:
+                self.tiles.move_to_end(key)
+                self.hits += 1
+                return parts
+            self.misses += 1
+
+        html = self.render(image, self.liked_marker, self.count_marker)
+        if html.count(self.liked_marker) != 1 or html.count(self.count_marker) != 1:
+            return None
+        before, rest = html.split(self.liked_marker, 1)
+        middle, after = rest.split(self.count_marker, 1)
+        parts = (before, middle, after)
+
+        with self.lock:
+            self.tiles[key] = parts
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > self.size:
+                self.tiles.popitem(last=False)
+        return parts
+
+    def render(self, image, liked_class, like_count):
+        """
+        Render method.
+
+        Renders an image's tile with the given liked class and like count.
+        """
+        return self.app.jinja_env.get_template('images/tile.html').render(image=image, liked_class=liked_class, like_count=like_count)
+
+    def stats(self):
+        """
+        Stats method.
+
+        Returns this worker's hit/miss counters and the number of cached tiles.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "size": len(self.tiles)
+            }
@@ -0,0 +1,115 @@
+import time
+import logging
+import threading
+from app.classes.Database import Database
+
+logger = logging.getLogger(__name__)
+
+class IndexLoader():
+    """
+    IndexLoader Class.
+
+    Loads the in-process indexes (see SnapshotIndex) from one shared read of
+    every image. The first reader of an index waits for it to load; after
+    that a timer thread reloads each index once it is older than its refresh
+    interval, so requests never wait on the full read or on the rebuild.
+    Indexes due at the same time share a single read.
+
+    """
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.app = None
+        self.indexes = []
+        self.timer = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Registers the loader, which the indexes register with in turn.
+        """
+        self.app = app
+        app.extensions['index_loader'] = self
+
+    def register(self, index):
+        """
+        Register method.
+
+        Adds an index to the ones kept loaded.
+        """
+        self.indexes.append(index)
+
+    def ensure_loaded(self, index):
+        """
+        Load method.
+
+        Loads an index on first use, along with every other index not loaded yet.
+        """
+        if index.loaded is not None:
+            return
+        with self.lock:
+            if index.loaded is None:
+                self.load([other for other in self.indexes if other.loaded is None])
+
+    def load(self, indexes):
+        """
+        Load method.
+
+        Reloads the given indexes from one read of every image and schedules
+        the next refresh. Called with the lock held.
+        """
+        for index in indexes:
+            index.begin()
+        try:
+            records = Database().get_all_images()
+        except Exception:
+            for index in indexes:
+                index.abort()
+            raise
+        read_at = time.time()
+        for index in indexes:
+            index.reload(records, read_at)
+        self.schedule()
+
+    def schedule(self):
+        """
+        Schedule method.
+
+        Starts the timer for the next index to fall due, unless one is already running. Called with the lock held.
+        """
+        loaded = [index for index in self.indexes if index.loaded is not None]
+        if self.timer is not None or not loaded:
+            return
+        due = min(index.loaded + index.refresh for index in loaded)
+        # Overdue after a failed refresh: retry at a tenth of the interval rather than straight away
+        retry = min(index.refresh for index in loaded) / 10
+        self.timer = threading.Timer(max(due - time.time(), retry), self.refresh_in_context)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def refresh_in_context(self):
+        """
+        Refresh method.
+
+        Reloads the indexes that are due from the timer thread, which has no app context of its own.
+        """
+        with self.app.app_context():
+            with self.lock:
+                self.timer = None
+                now = time.time()
+                due = [index for index in self.indexes if index.loaded is not None and now + 1 >= index.loaded + index.refresh]
+                try:
+                    if due:
+                        self.load(due)
+                except Exception as err:
+                    # The indexes keep serving their current contents until the next attempt
+                    logger.warning('Could not refresh the indexes: %s', err)
+                finally:
+                    self.schedule()
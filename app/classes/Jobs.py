@@ -0,0 +1,219 @@
+import logging
+import os
+import json
+import time
+import sqlite3
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+class Jobs():
+    """
+    Jobs Class.
+
+    Background job queue backed by a local process pool. Every job is written
+    to an on-disk SQLite journal before it is submitted, so jobs that were
+    pending or running when a worker stopped are picked up again on restart.
+
+    Each job kind has a work function, run in a pool process, and a complete
+    function, run back in the app with an app context, e.g. to update Firebase.
+
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT, payload TEXT, status TEXT, attempts INTEGER,
+            owner INTEGER, error TEXT, created REAL, updated REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+    """
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.app = None
+        self.handlers = {}
+        self.executor = None
+        self.started = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the pool size and journal location from the Flask app and registers the queue.
+        """
+        app.config.setdefault('JOBS_WORKERS', 2)
+        app.config.setdefault('JOBS_MAX_ATTEMPTS', 3)
+        app.config.setdefault('JOBS_JOURNAL', os.path.join(app.instance_path, 'jobs.sqlite3'))
+        self.app = app
+        self.workers = app.config['JOBS_WORKERS']
+        self.max_attempts = app.config['JOBS_MAX_ATTEMPTS']
+        self.path = app.config['JOBS_JOURNAL']
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connect().executescript(self.schema)
+        app.extensions['jobs'] = self
+
+        @app.before_request
+        def start_jobs():
+            self.start()
+
+    def register(self, kind, work, complete, fail=None):
+        """
+        Register method.
+
+        Registers the functions for a job kind. work must be a module level
+        (picklable) function taking the payload; complete takes the payload and
+        work's result; fail takes the payload and the error message.
+        """
+        self.handlers[kind] = (work, complete, fail)
+
+    def connect(self):
+        """
+        Connect method.
+
+        Returns this thread's journal connection.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def start(self):
+        """
+        Start method.
+
+        Creates the process pool on first use and resumes journalled jobs whose
+        owning process is no longer alive.
+        """
+        if self.started:
+            return
+        with self.lock:
+            if self.started:
+                return
+            self.executor = self.create_executor()
+            self.started = True
+        for job_id, owner in self.connect().execute("SELECT id, owner FROM jobs WHERE status IN ('pending', 'running')").fetchall():
+            # Nothing has been enqueued by this process yet, so its own pid here is a reused one
+            if owner != os.getpid() and self.is_alive(owner):
+                continue
+            self.claim(job_id, owner)
+
+    def create_executor(self):
+        """
+        Create method.
+
+        Returns a new process pool. Workers are spawned rather than forked so
+        they never inherit the app's threads or open connections.
+        """
+        context = multiprocessing.get_context('spawn')
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    def enqueue(self, kind, payload):
+        """
+        Enqueue method.
+
+        Journals a job and submits it to the pool. Returns the job id.
+        """
+        if kind not in self.handlers:
+            raise Exception("Unknown job: " + kind)
+        self.start()
+        now = time.time()
+        cursor = self.connect().execute(
+            "INSERT INTO jobs (kind, payload, status, attempts, owner, created, updated) VALUES (?, ?, 'pending', 0, ?, ?, ?)",
+            (kind, json.dumps(payload), os.getpid(), now, now))
+        self.submit(cursor.lastrowid)
+        return cursor.lastrowid
+
+    def claim(self, job_id, owner):
+        """
+        Claim method.
+
+        Takes over a job left behind by a stopped process, unless another
+        process claimed it first.
+        """
+        claimed = self.connect().execute(
+            "UPDATE jobs SET owner = ?, status = 'pending', updated = ? WHERE id = ? AND owner IS ?",
+            (os.getpid(), time.time(), job_id, owner)).rowcount
+        if claimed:
+            self.submit(job_id)
+
+    def submit(self, job_id):
+        """
+        Submit method.
+
+        Runs a journalled job in the pool.
+        """
+        connection = self.connect()
+        kind, payload = connection.execute("SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        connection.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE id = ?", (time.time(), job_id))
+        payload = json.loads(payload)
+        try:
+            future = self.executor.submit(self.handlers[kind][0], payload)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); replace the pool and try again
+            with self.lock:
+                self.executor = self.create_executor()
+            future = self.executor.submit(self.handlers[kind][0], payload)
+        future.add_done_callback(lambda future: self.finish(job_id, kind, payload, future))
+
+    def finish(self, job_id, kind, payload, future):
+        """
+        Finish method.
+
+        Runs the job's complete function and marks it done, or retries it until
+        it runs out of attempts.
+        """
+        work, complete, fail = self.handlers[kind]
+        connection = self.connect()
+        try:
+            result = future.result()
+            with self.app.app_context():
+                complete(payload, result)
+            connection.execute("UPDATE jobs SET status = 'done', error = NULL, updated = ? WHERE id = ?", (time.time(), job_id))
+        except Exception as err:
+            logger.warning('Job %s (%s) failed: %s', job_id, kind, err)
+            attempts = connection.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            connection.execute("UPDATE jobs SET status = 'pending', error = ?, updated = ? WHERE id = ?", (str(err), time.time(), job_id))
+            if attempts < self.max_attempts:
+                self.submit(job_id)
+                return
+            connection.execute("UPDATE jobs SET status = 'failed', updated = ? WHERE id = ?", (time.time(), job_id))
+            if fail is not None:
+                with self.app.app_context():
+                    fail(payload, str(err))
+
+    def is_alive(self, pid):
+        """
+        Check method.
+
+        Returns whether a process with this pid is still running.
+        """
+        if not pid:
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def stats(self):
+        """
+        Stats method.
+
+        Returns the number of journalled jobs in each status.
+        """
+        rows = self.connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
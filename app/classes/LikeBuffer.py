@@ -0,0 +1,250 @@
+import os
+import atexit
+import logging
+import sqlite3
+import threading
+from flask import current_app as flask_app
+from app.classes.Database import Database
+
+logger = logging.getLogger(__name__)
+
+class LikeBuffer():
+    """
+    LikeBuffer Class.
+
+    Collects like toggles and writes them to Firebase in batches. Toggles
+    of the same image by the same user within the flush window are
+    coalesced, so liking and unliking an image straight away writes nothing.
+    Each like is its own node (users/<uid>/likes/<image id>), so a flush is a
+    single multi-path update rather than a rewrite of every user record. The
+    same update adjusts each image's like_count with a server-side increment,
+    so counts from concurrent workers never overwrite each other. Counts are
+    only adjusted for images that still exist when the batch is written.
+
+    Toggles are buffered in a SQLite journal shared by the workers of a host,
+    where sessions live too, so a like and an unlike of the same image
+    handled by two workers coalesce into the latest one instead of being
+    written in an arbitrary order. Whichever worker flushes takes every
+    buffered toggle. Workers flush at exit, and toggles left behind by a
+    worker that did not are written by the next flush on the host. Only a
+    batch being written when its worker is killed outright is lost, until
+    rebuild-like-counts is run.
+
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS likes (
+            user_id TEXT, image_id TEXT, stored INTEGER, liked INTEGER,
+            PRIMARY KEY (user_id, image_id)
+        );
+    """
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.app = None
+        self.timer = None
+        self.resumed = False
+        self.closed = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the flush window, batch size and journal location from the Flask app and registers the buffer.
+        """
+        app.config.setdefault('LIKE_FLUSH_INTERVAL', 2.0)
+        app.config.setdefault('LIKE_BATCH_SIZE', 500)
+        app.config.setdefault('LIKE_JOURNAL', os.path.join(app.instance_path, 'likes.sqlite3'))
+        self.app = app
+        self.interval = app.config['LIKE_FLUSH_INTERVAL']
+        self.batch_size = app.config['LIKE_BATCH_SIZE']
+        self.path = app.config['LIKE_JOURNAL']
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connect().executescript(self.schema)
+        app.extensions['likes'] = self
+        atexit.register(self.close)
+
+        @app.before_request
+        def resume_likes():
+            self.resume()
+
+    def connect(self):
+        """
+        Connect method.
+
+        Returns this thread's journal connection, reopening it after a fork.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def resume(self):
+        """
+        Start method.
+
+        Schedules a flush of the toggles a stopped worker left in the journal, once per process.
+        """
+        if self.resumed:
+            return
+        self.resumed = True
+        if self.connect().execute("SELECT 1 FROM likes LIMIT 1").fetchone():
+            with self.lock:
+                self.schedule()
+
+    def record(self, user_id, image_id, liked):
+        """
+        Record method.
+
+        Buffers a like (liked=True) or unlike of an image and schedules a flush.
+        """
+        connection = self.connect()
+        # Only actual changes are recorded, so Firebase holds the opposite of the first toggle
+        connection.execute(
+            "INSERT INTO likes VALUES (?, ?, ?, ?) ON CONFLICT (user_id, image_id) DO UPDATE SET liked = excluded.liked",
+            (user_id, image_id, int(not liked), int(liked)))
+        if connection.execute("SELECT COUNT(*) FROM likes").fetchone()[0] >= self.batch_size:
+            self.flush()
+        else:
+            with self.lock:
+                self.schedule()
+
+    def schedule(self):
+        """
+        Schedule method.
+
+        Starts the flush timer unless one is already running. Called with the lock held.
+        """
+        if self.timer is None and not self.closed:
+            self.timer = threading.Timer(self.interval, self.flush_in_context)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_in_context(self):
+        """
+        Flush method.
+
+        Runs a flush from the timer thread, which has no app context of its own.
+        """
+        with self.app.app_context():
+            self.flush()
+
+    def close(self):
+        """
+        Flush method.
+
+        Writes the buffered toggles as the worker exits. Those that cannot be
+        written stay in the journal for the next flush on the host.
+        """
+        self.closed = True
+        try:
+            self.flush_in_context()
+        except Exception as err:
+            logger.warning('Could not write the buffered likes at exit: %s', err)
+
+    def take(self):
+        """
+        Flush method.
+
+        Removes every buffered toggle from the journal and returns them as
+        (user id, image id) -> [state in Firebase, latest state].
+        """
+        connection = self.connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute("SELECT user_id, image_id, stored, liked FROM likes").fetchall()
+            connection.execute("DELETE FROM likes")
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return {(user_id, image_id): [bool(stored), bool(liked)] for user_id, image_id, stored, liked in rows}
+
+    def flush(self):
+        """
+        Flush method.
+
+        Writes every buffered change in multi-path updates of at most
+        batch_size paths. Changes that fail to write are put back for the
+        next flush.
+
+        Returns:
+        list: (user id, image id, liked) of the changes written
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        pending = self.take()
+
+        # Toggled back to where they started: nothing to write
+        changes = [(key, states) for key, states in pending.items() if states[0] != states[1]]
+        written = []
+        database = Database()
+        for start in range(0, len(changes), self.batch_size):
+            batch = changes[start:start + self.batch_size]
+            updates = {}
+            counts = {}
+            for (user_id, image_id), (stored, liked) in batch:
+                # Null removes the node
+                updates["users/{0}/likes/{1}".format(user_id, image_id)] = True if liked else None
+                counts[image_id] = counts.get(image_id, 0) + (1 if liked else -1)
+            try:
+                # An increment of a deleted image's count would recreate its record with only that field
+                existing = database.existing_images([image_id for image_id, delta in counts.items() if delta])
+                counts = {image_id: delta for image_id, delta in counts.items() if image_id in existing}
+                for image_id, delta in counts.items():
+                    if delta:
+                        updates["images/{0}/like_count".format(image_id)] = {".sv": {"increment": delta}}
+                database.update_paths(updates)
+            except Exception as err:
+                if database.status_code(err) == 400:
+                    # Rejected as a whole, so retrying it unchanged would fail forever. Entries with
+                    # invalid keys are dropped and the rest retried; without any, nothing can be salvaged.
+                    valid = [entry for entry in batch if Database.valid_key(entry[0][0]) and Database.valid_key(entry[0][1])]
+                    if len(valid) == len(batch):
+                        valid = []
+                    logger.warning('Dropped %s likes rejected by Firebase: %s', len(batch) - len(valid), err)
+                    if valid:
+                        self.restore(valid)
+                    continue
+                logger.warning('Could not write %s likes: %s', len(batch), err)
+                self.restore(batch)
+                continue
+            written.extend((user_id, image_id, liked) for (user_id, image_id), (stored, liked) in batch)
+            for image_id, delta in counts.items():
+                if delta:
+                    flask_app.extensions['trending'].like(image_id, delta)
+        return written
+
+    def restore(self, batch):
+        """
+        Restore method.
+
+        Puts changes that failed to write back in the journal, under any newer
+        toggles recorded in the meantime, and schedules another flush.
+        """
+        self.connect().executemany(
+            "INSERT INTO likes VALUES (?, ?, ?, ?) ON CONFLICT (user_id, image_id) DO UPDATE SET stored = excluded.stored",
+            [(user_id, image_id, int(stored), int(liked)) for (user_id, image_id), (stored, liked) in batch])
+        with self.lock:
+            self.schedule()
+
+    def discard(self, image_id):
+        """
+        Discard method.
+
+        Drops buffered changes to an image that is being deleted, so a later
+        flush does not recreate its record just to hold a like count.
+        """
+        self.connect().execute("DELETE FROM likes WHERE image_id = ?", (image_id,))
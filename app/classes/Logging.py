@@ -0,0 +1,154 @@
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+class Payload():
+    """
+    Payload Class.
+
+    Size-capped summary of a value for the log, e.g. a page of image
+    records. It is only built if the record is actually emitted, so
+    `logger.debug('Fetched %s', Payload(images))` costs nothing when debug
+    logging is off, and at most `limit` characters when it is on.
+
+    """
+
+    limit = 1000
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit or self.limit
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, dict):
+            items = ['{0!r}: {1!r}'.format(key, child) for key, child in self.head(value.items())]
+            return self.cap('<dict of {0}> {{{1}}}'.format(len(value), ', '.join(items)), len(value) - len(items))
+        if isinstance(value, (list, tuple, set, frozenset)):
+            items = [repr(child) for child in self.head(value)]
+            return self.cap('<{0} of {1}> [{2}]'.format(type(value).__name__, len(value), ', '.join(items)), len(value) - len(items))
+        return self.cap(repr(value) if not isinstance(value, str) else value, 0)
+
+    def head(self, items):
+        """
+        Summary method.
+
+        Yields items until their representations would pass the limit, so large payloads are never formatted in full.
+        """
+        length = 0
+        for item in items:
+            yield item
+            length += len(repr(item))
+            if length >= self.limit:
+                return
+
+    def cap(self, text, remaining):
+        """
+        Summary method.
+
+        Truncates the text to the limit, noting what was left out.
+        """
+        if len(text) > self.limit:
+            return text[:self.limit] + '... ({0} more characters{1})'.format(
+                len(text) - self.limit, ', {0} more items'.format(remaining) if remaining else '')
+        if remaining:
+            return text + ' ... ({0} more items)'.format(remaining)
+        return text
+
+    __repr__ = __str__
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    DroppingQueueHandler Class.
+
+    Queue handler that never blocks the request: once the queue is full,
+    records are dropped and counted instead of waiting for the writer.
+
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Logging():
+    """
+    Logging Class.
+
+    Sets up the app's logging. Records from the app logger and every module
+    logger below it (app.classes.Database, app.models.Image, ...) are put
+    on an in-memory queue by the request thread and written out by a
+    background listener, so slow log I/O never holds up a request. The
+    overall level and per-module levels come from the app config, and
+    records below them are discarded before any formatting happens.
+
+    """
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.handler = None
+        self.listener = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the log levels and queue size from the Flask app and moves the
+        app logger's handlers behind the queue.
+        """
+        app.config.setdefault('LOG_LEVEL', 'INFO')
+        app.config.setdefault('LOG_LEVELS', {})
+        app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+        app.config.setdefault('LOG_PAYLOAD_LIMIT', 1000)
+        Payload.limit = app.config['LOG_PAYLOAD_LIMIT']
+
+        logger = app.logger
+        logger.setLevel(app.config['LOG_LEVEL'])
+        for name, level in app.config['LOG_LEVELS'].items():
+            logging.getLogger(name).setLevel(level)
+
+        handlers = [handler for handler in logger.handlers if not isinstance(handler, QueueHandler)]
+        self.handler = DroppingQueueHandler(queue.Queue(app.config['LOG_QUEUE_SIZE']))
+        self.listener = QueueListener(self.handler.queue, *handlers, respect_handler_level=True)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(self.handler)
+        self.listener.start()
+        # Writes out whatever is still queued when the process exits
+        atexit.register(self.listener.stop)
+        app.extensions['logging'] = self
+
+    @staticmethod
+    def parse_levels(text):
+        """
+        Config method.
+
+        Parses per-module levels written as "app.classes.Database=DEBUG,app.classes.Replica=WARNING".
+        """
+        levels = {}
+        for entry in (text or '').split(','):
+            if '=' in entry:
+                name, level = entry.split('=', 1)
+                levels[name.strip()] = level.strip().upper()
+        return levels
+
+    def stats(self):
+        """
+        Stats method.
+
+        Returns the queue depth and the number of records dropped because it was full.
+        """
+        return {"queued": self.handler.queue.qsize(), "dropped": self.handler.dropped}
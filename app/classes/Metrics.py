@@ -0,0 +1,351 @@
+import logging
+import sys
+import time
+import json
+import inspect
+import threading
+import functools
+import contextvars
+from collections import deque
+from urllib.parse import urlsplit
+from flask import g, request, has_request_context, before_render_template, template_rendered
+
+logger = logging.getLogger(__name__)
+
+# Kinds of span currently open in this thread or task, so only the outermost span of a kind counts towards a request
+active_kinds = contextvars.ContextVar('active_kinds', default=frozenset())
+
+class Histogram():
+    """
+    Histogram Class.
+
+    Cumulative bucket counts, sum and count of observed durations, as Prometheus expects them.
+
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics():
+    """
+    Metrics Class.
+
+    Times the hot path of every request. Spans are recorded around every
+    HTTP request sent through the shared Firebase session ("firebase"),
+    Upload.upload ("upload") and render_template ("render"), and each
+    request's outermost spans are summed per kind, with a count of Firebase
+    calls. Reads answered by the replica or the caches send nothing, so they
+    are not counted. The totals go back to
+    the client in a Server-Timing header and to the log as one JSON line,
+    and every span and request duration is aggregated into histograms
+    served in the Prometheus text format at /metrics, to clients holding
+    METRICS_TOKEN. Histograms are per worker process.
+
+    With METRICS_PROFILE enabled, a sampling profiler takes the stack of
+    every in-flight request thread every METRICS_PROFILE_INTERVAL seconds,
+    and requests slower than METRICS_PROFILE_THRESHOLD keep their folded
+    stacks (served at /metrics/profiles) and log their hottest frames.
+
+    """
+
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    call_buckets = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        # (kind, name) -> Histogram of span durations
+        self.spans = {}
+        # endpoint -> Histogram of request durations
+        self.requests = {}
+        # endpoint -> Histogram of Firebase calls per request
+        self.calls = {}
+        self.lock = threading.Lock()
+        # thread id -> {folded stack: samples} for requests being profiled
+        self.sampling = {}
+        self.profiles = deque(maxlen=20)
+        self.sampler = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the profiler settings from the Flask app, instruments the hot
+        path classes and registers the request hooks.
+        """
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.config.setdefault('METRICS_PROFILE', False)
+        app.config.setdefault('METRICS_PROFILE_INTERVAL', 0.005)
+        app.config.setdefault('METRICS_PROFILE_THRESHOLD', 1.0)
+        self.app = app
+        self.profile = app.config['METRICS_PROFILE']
+        self.interval = app.config['METRICS_PROFILE_INTERVAL']
+        self.threshold = app.config['METRICS_PROFILE_THRESHOLD']
+        app.extensions['metrics'] = self
+
+        from app.classes.Upload import Upload
+        # Firebase calls are timed where they leave the process, see instrument_session
+        self.instrument(Upload, "upload", names=["upload"])
+        before_render_template.connect(self.render_started, app)
+        template_rendered.connect(self.render_finished, app)
+        app.before_request(self.request_started)
+        app.after_request(self.request_finished)
+        app.teardown_request(self.request_teardown)
+
+    def instrument(self, cls, kind, names=None, skip=()):
+        """
+        Instrument method.
+
+        Wraps the public methods of a class (or the named ones) in spans. Classes are only wrapped once per process.
+        """
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or name in skip or (names is not None and name not in names) or not inspect.isfunction(method):
+                continue
+            if getattr(method, '__metrics__', False):
+                continue
+            setattr(cls, name, self.timed(kind, cls.__name__ + '.' + name, method))
+
+    def timed(self, kind, name, method):
+        """
+        Instrument method.
+
+        Returns the method wrapped in a span.
+        """
+        metrics = self
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            token, started = metrics.start(kind)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                metrics.finish(kind, name, token, started)
+        wrapper.__metrics__ = True
+        return wrapper
+
+    def instrument_session(self, session):
+        """
+        Instrument method.
+
+        Wraps a requests session's send in "firebase" spans, named after the
+        method and the node or service requested, e.g. "GET images".
+        """
+        send = session.send
+        if getattr(send, '__metrics__', False):
+            return
+        metrics = self
+
+        @functools.wraps(send)
+        def timed_send(prepared, **kwargs):
+            node = urlsplit(prepared.url).path.strip('/').split('/')[0]
+            name = '{0} {1}'.format(prepared.method, node[:-len('.json')] if node.endswith('.json') else node or '/')
+            token, started = metrics.start("firebase")
+            try:
+                return send(prepared, **kwargs)
+            finally:
+                metrics.finish("firebase", name, token, started)
+        timed_send.__metrics__ = True
+        session.send = timed_send
+
+    def start(self, kind):
+        """
+        Span method.
+
+        Opens a span, returning what finish needs to close it.
+        """
+        kinds = active_kinds.get()
+        token = active_kinds.set(kinds | {kind}) if kind not in kinds else None
+        return token, time.perf_counter()
+
+    def finish(self, kind, name, token, started):
+        """
+        Span method.
+
+        Closes a span: records its duration and, for the outermost span of its kind, adds it to the request's totals.
+        """
+        elapsed = time.perf_counter() - started
+        self.observe(self.spans, (kind, name), elapsed, self.buckets)
+        if token is None:
+            return
+        active_kinds.reset(token)
+        if has_request_context() and 'timings' in g:
+            with self.lock:
+                total = g.timings.setdefault(kind, [0, 0.0])
+                total[0] += 1
+                total[1] += elapsed
+
+    def observe(self, histograms, key, value, buckets):
+        """
+        Histogram method.
+
+        Adds an observation to the histogram for key.
+        """
+        with self.lock:
+            if key not in histograms:
+                histograms[key] = Histogram(buckets)
+            histograms[key].observe(value)
+
+    def render_started(self, sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('renders', []).append(self.start("render"))
+
+    def render_finished(self, sender, template, context, **extra):
+        if has_request_context() and g.get('renders'):
+            token, started = g.renders.pop()
+            self.finish("render", template.name or "string", token, started)
+
+    def request_started(self):
+        """
+        Request hook.
+
+        Starts the request's timings and, when profiling, its stack sampling.
+        """
+        g.timings = {}
+        g.request_started = time.perf_counter()
+        if self.profile:
+            with self.lock:
+                self.sampling[threading.get_ident()] = {}
+            self.start_sampler()
+
+    def request_finished(self, response):
+        """
+        Request hook.
+
+        Records the request's duration and Firebase calls, and reports its timings.
+        """
+        if 'request_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        endpoint = request.endpoint or 'unmatched'
+        timings = dict(g.timings)
+        calls = timings.get("firebase", [0, 0.0])[0]
+        self.observe(self.requests, endpoint, elapsed, self.buckets)
+        self.observe(self.calls, endpoint, calls, self.call_buckets)
+
+        response.headers['Server-Timing'] = ', '.join(
+            ['{0};dur={1:.1f};desc="{2}x"'.format(kind, total * 1000, count) for kind, (count, total) in sorted(timings.items())] +
+            ['total;dur={0:.1f}'.format(elapsed * 1000)])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({
+                "endpoint": endpoint,
+                "status": response.status_code,
+                "duration": round(elapsed, 4),
+                "spans": {kind: {"count": count, "duration": round(total, 4)} for kind, (count, total) in timings.items()}
+            }))
+
+        return response
+
+    def request_teardown(self, error=None):
+        """
+        Request hook.
+
+        Closes the spans of renders that raised, and stops sampling the
+        request, keeping its profile if it was slow, even when it failed.
+        """
+        # A failed render never sends template_rendered, and its kind would stay active on this thread
+        while g.get('renders'):
+            token, started = g.renders.pop()
+            if token is not None:
+                active_kinds.reset(token)
+        if not self.profile or 'request_started' not in g:
+            return
+        with self.lock:
+            samples = self.sampling.pop(threading.get_ident(), {})
+        elapsed = time.perf_counter() - g.request_started
+        if elapsed >= self.threshold and samples:
+            self.keep_profile(request.endpoint or 'unmatched', elapsed, samples)
+
+    def start_sampler(self):
+        """
+        Profiler method.
+
+        Starts the thread sampling request stacks, once.
+        """
+        if self.sampler is not None:
+            return
+        with self.lock:
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample, name='metrics-sampler', daemon=True)
+                self.sampler.start()
+
+    def sample(self):
+        """
+        Profiler method.
+
+        Takes the stack of every thread serving a request, folded into "file:function:line;..." from the outermost frame.
+        """
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, samples in self.sampling.items():
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append('{0}:{1}:{2}'.format(code.co_filename.rsplit('/', 1)[-1], code.co_name, frame.f_lineno))
+                        frame = frame.f_back
+                    if stack:
+                        folded = ';'.join(reversed(stack))
+                        samples[folded] = samples.get(folded, 0) + 1
+
+    def keep_profile(self, endpoint, elapsed, samples):
+        """
+        Profiler method.
+
+        Keeps a slow request's folded stacks and logs the frames it spent the most samples in.
+        """
+        self.profiles.append({"endpoint": endpoint, "duration": round(elapsed, 4), "at": time.time(), "stacks": samples})
+        leaves = {}
+        for folded, count in samples.items():
+            leaf = folded.rsplit(';', 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + count
+        hottest = sorted(leaves.items(), key=lambda item: -item[1])[:5]
+        logger.warning('Slow request %s took %.3fs, hottest frames: %s', endpoint, elapsed,
+                                ', '.join('{0} ({1})'.format(leaf, count) for leaf, count in hottest))
+
+    def render(self):
+        """
+        Export method.
+
+        Returns every histogram in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def histogram(metric, help_text, histograms, label):
+            lines.append('# HELP {0} {1}'.format(metric, help_text))
+            lines.append('# TYPE {0} histogram'.format(metric))
+            for key, values in sorted(histograms.items()):
+                labels = label(key)
+                for bound, count in zip(values.buckets, values.counts):
+                    lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(metric, labels, bound, count))
+                lines.append('{0}_bucket{{{1},le="+Inf"}} {2}'.format(metric, labels, values.count))
+                lines.append('{0}_sum{{{1}}} {2}'.format(metric, labels, values.sum))
+                lines.append('{0}_count{{{1}}} {2}'.format(metric, labels, values.count))
+
+        def quote(value):
+            return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+        with self.lock:
+            histogram('app_request_duration_seconds', 'Time spent serving requests.', self.requests,
+                      lambda endpoint: 'endpoint=' + quote(endpoint))
+            histogram('app_request_firebase_calls', 'Firebase calls made per request.', self.calls,
+                      lambda endpoint: 'endpoint=' + quote(endpoint))
+            histogram('app_span_duration_seconds', 'Time spent in Firebase calls, uploads and template rendering.', self.spans,
+                      lambda key: 'kind={0},name={1}'.format(quote(key[0]), quote(key[1])))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,123 @@
+import hashlib
+from flask import g, request, session, has_request_context
+from flask import current_app as flask_app
+
+class PageCache():
+    """
+    PageCache Class.
+
+    Full response cache for anonymous visitors. GET requests without a
+    session cookie to the endpoints in PAGE_CACHE_ENDPOINTS are served from
+    the listing cache once rendered, and every such response carries an
+    ETag, so browsers revalidating a page they already have get a 304 with
+    no body.
+
+    PAGE_CACHE_ENDPOINTS maps each endpoint to the query parameters its view
+    reads. Pages are keyed on the endpoint, its URL arguments and those
+    parameters only, and requests carrying any other parameter are not
+    cached, so made-up query strings cannot fill the cache.
+
+    A page is tagged with the feed pages it was rendered from (see
+    PageCache.depends), so the writes that invalidate those pages drop it
+    too, and with "page" to drop every cached page at once. Pages that
+    store anything in the session, e.g. a flashed error, are never kept.
+
+    """
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.endpoints = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the cached endpoints from the Flask app and registers the request hooks.
+        """
+        app.config.setdefault('PAGE_CACHE_ENDPOINTS', {'home.index': [], 'images.category': ['cursor']})
+        self.endpoints = app.config['PAGE_CACHE_ENDPOINTS']
+        app.before_request(self.serve)
+        app.after_request(self.keep)
+        app.extensions['page_cache'] = self
+
+    @staticmethod
+    def depends(tags):
+        """
+        Cache method.
+
+        Records cache tags the current page was rendered from.
+        """
+        if has_request_context():
+            g.setdefault('page_tags', set()).update(tags)
+
+    def cacheable(self):
+        """
+        Check method.
+
+        Whether the current request may be answered with, or stored as, a shared page.
+        """
+        if request.method != 'GET' or request.endpoint not in self.endpoints:
+            return False
+        if flask_app.session_interface.get_cookie_name(flask_app) in request.cookies:
+            return False
+        params = self.endpoints[request.endpoint]
+        return all(name in params and len(request.args.getlist(name)) == 1 for name in request.args)
+
+    def key(self):
+        """
+        Cache method.
+
+        Returns the cache key of the current page.
+        """
+        params = tuple(request.args.get(name) for name in self.endpoints[request.endpoint])
+        return ("page", request.endpoint, tuple(sorted((request.view_args or {}).items())), params)
+
+    def serve(self):
+        """
+        Request hook.
+
+        Answers the request from a cached page, if there is one.
+        """
+        if not self.cacheable():
+            return None
+        cache = flask_app.extensions['image_cache']
+        found, page = cache.lookup(self.key())
+        if not found:
+            # A page rendered across an invalidation may show what it dropped
+            g.page_generation = cache.generation()
+            return None
+        g.page_cached = True
+        response = flask_app.response_class(page["body"], mimetype=page["mimetype"])
+        return self.conditional(response, page["etag"])
+
+    def keep(self, response):
+        """
+        Request hook.
+
+        Stores an anonymous page once rendered, and lets the client revalidate it.
+        """
+        if g.get('page_cached') or not self.cacheable():
+            return response
+        if response.status_code != 200 or response.direct_passthrough or 'Set-Cookie' in response.headers or session:
+            return response
+        etag = hashlib.sha1(response.get_data()).hexdigest()
+        # Stored as text, which every cache backend can serialise
+        page = {"body": response.get_data(as_text=True), "mimetype": response.mimetype, "etag": etag}
+        flask_app.extensions['image_cache'].store(self.key(), page, ["page"] + sorted(g.get('page_tags', ())), g.get('page_generation'))
+        return self.conditional(response, etag)
+
+    def conditional(self, response, etag):
+        """
+        Response method.
+
+        Adds the validators to a shared page and turns it into a 304 when the client's copy is current.
+        """
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        return response.make_conditional(request)
@@ -0,0 +1,131 @@
+import logging
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+class QueryResult():
+    """
+    QueryResult Class.
+
+    Outcome of one call run by the QueryExecutor: its value, or the error it
+    raised or timed out with, so a page can render without the reads it
+    could do without.
+
+    """
+
+    def __init__(self, name, value=None, error=None, elapsed=0.0):
+        self.name = name
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def get(self, default=None):
+        """
+        Get method.
+
+        Returns the value, or the default when the call failed.
+        """
+        return self.value if self.error is None else default
+
+    def result(self):
+        """
+        Get method.
+
+        Returns the value, or raises the call's error, for reads the page cannot do without.
+        """
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class QueryExecutor():
+    """
+    QueryExecutor Class.
+
+    Runs independent reads for one page at the same time, so the page waits
+    for the slowest of them instead of their sum. The calls (e.g. Database
+    methods or index loads) run in a bounded thread pool shared by the
+    process, in a copy of the caller's context, so they see the same app,
+    request and session. The edit page uses it to load the image and the
+    similarity index side by side.
+
+    Each call gets `timeout` seconds. A call that fails or times out does not
+    fail the others: every call gets a QueryResult and the caller decides
+    which ones it needs. A timed-out blocking call cannot be interrupted and
+    finishes in the background, holding its thread until then.
+
+    """
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.pool = None
+        self.timeout = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the pool size and default timeout from the Flask app and registers the executor.
+        """
+        app.config.setdefault('QUERY_WORKERS', 16)
+        app.config.setdefault('QUERY_TIMEOUT', 5)
+        self.pool = ThreadPoolExecutor(max_workers=app.config['QUERY_WORKERS'], thread_name_prefix='query')
+        self.timeout = app.config['QUERY_TIMEOUT']
+        app.extensions['queries'] = self
+
+    def submit(self, call):
+        """
+        Run method.
+
+        Runs a blocking call in the pool, in a copy of the caller's context, and returns its future.
+        """
+        context = contextvars.copy_context()
+        started = time.perf_counter()
+
+        def timed():
+            return context.run(call), time.perf_counter() - started
+
+        return self.pool.submit(timed)
+
+    def run(self, calls, timeout=None):
+        """
+        Run method.
+
+        Runs a dict of blocking calls concurrently, e.g.
+        {"feed": lambda: database.get_images(), "user": lambda: database.get_user(user_id)},
+        and returns a dict of QueryResults with the same keys.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        futures = {name: self.submit(call) for name, call in calls.items()}
+        wait(futures.values(), timeout=timeout)
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                results[name] = self.failed(name, Exception("The request took too long, please try again."), timeout)
+            elif future.exception() is not None:
+                results[name] = self.failed(name, future.exception(), 0.0)
+            else:
+                value, elapsed = future.result()
+                results[name] = QueryResult(name, value, elapsed=elapsed)
+        return results
+
+    def failed(self, name, error, elapsed):
+        """
+        Result method.
+
+        Logs and returns the result of a call that failed or timed out.
+        """
+        logger.warning('Query %s failed after %.3fs: %s', name, elapsed, error)
+        return QueryResult(name, error=error, elapsed=elapsed)
@@ -0,0 +1,392 @@
+import logging
+import os
+import json
+import time
+import sqlite3
+import threading
+from flask import g, session, has_request_context
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where every worker syncs its own replica
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class Replica():
+    """
+    Replica Class.
+
+    Optional local mirror of the Firebase images and users nodes in SQLite,
+    with indexes on user_id, category, created_at and the feed keys, so feed
+    pages and single images are read at local-disk latency instead of over
+    the network.
+
+    One worker per host holds a lock file and keeps the mirror fresh: it
+    follows each node through the Realtime Database streaming (server-sent
+    events) API, whose first event is a full snapshot, and does a full
+    resync every `resync` seconds in case an event was missed. The other
+    workers only read. Reads fall back to Firebase whenever the mirror has
+    not heard from the stream for `max_lag` seconds.
+
+    Images a request writes are read from Firebase by that request, and by
+    its session for `write_window` seconds after, so users see their own
+    uploads and edits before the stream delivers them (see Replica.wrote).
+
+    """
+
+    nodes = ("images", "users")
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS images (
+            id TEXT PRIMARY KEY, data TEXT, user_id TEXT, category TEXT, created_at INTEGER,
+            sort_key TEXT, category_key TEXT, user_key TEXT
+        );
+        CREATE INDEX IF NOT EXISTS images_user_id ON images (user_id);
+        CREATE INDEX IF NOT EXISTS images_category ON images (category);
+        CREATE INDEX IF NOT EXISTS images_created_at ON images (created_at);
+        CREATE INDEX IF NOT EXISTS images_sort_key ON images (sort_key);
+        CREATE INDEX IF NOT EXISTS images_category_key ON images (category_key);
+        CREATE INDEX IF NOT EXISTS images_user_key ON images (user_key);
+        CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, data TEXT);
+        CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value REAL);
+    """
+
+    # Indexed columns, which are also the only ones feeds may be read by
+    columns = ("user_id", "category", "created_at", "sort_key", "category_key", "user_key")
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.app = None
+        self.started = False
+        self.leader = False
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the replica settings from the Flask app and registers it. Syncing
+        starts with the first request, so CLI commands never start it.
+        """
+        app.config.setdefault('REPLICA_PATH', os.path.join(app.instance_path, 'replica.sqlite3'))
+        app.config.setdefault('REPLICA_RESYNC', 600)
+        app.config.setdefault('REPLICA_MAX_LAG', 120)
+        app.config.setdefault('REPLICA_WRITE_WINDOW', 30)
+        self.app = app
+        self.path = app.config['REPLICA_PATH']
+        self.resync = app.config['REPLICA_RESYNC']
+        self.max_lag = app.config['REPLICA_MAX_LAG']
+        self.write_window = app.config['REPLICA_WRITE_WINDOW']
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connect().executescript(self.schema)
+        app.extensions['replica'] = self
+
+        @app.before_request
+        def start_replica():
+            self.start()
+
+    def connect(self):
+        """
+        Connect method.
+
+        Returns this thread's connection, reopening it after a fork so worker
+        processes never share a SQLite handle.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def start(self):
+        """
+        Start method.
+
+        Starts the thread that competes for the sync lock and, once it holds
+        it, keeps the mirror fresh.
+        """
+        if self.started:
+            return
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        threading.Thread(target=self.run, name='replica', daemon=True).start()
+
+    def stop(self):
+        """
+        Stop method.
+
+        Stops syncing at the next event or keep-alive.
+        """
+        self.stopped.set()
+
+    def run(self):
+        """
+        Sync method.
+
+        Waits to become the syncing worker, then streams every node and resyncs periodically.
+        """
+        while not self.stopped.is_set():
+            if self.acquire():
+                break
+            self.stopped.wait(30)
+        if self.stopped.is_set():
+            return
+        for node in self.nodes:
+            threading.Thread(target=self.follow, args=(node,), name='replica-' + node, daemon=True).start()
+        while not self.stopped.wait(self.resync):
+            try:
+                self.full_sync()
+            except Exception as err:
+                logger.warning('Replica resync failed: %s', err)
+
+    def acquire(self):
+        """
+        Lock method.
+
+        Takes the host-wide sync lock without blocking. The lock file stays
+        open for the life of the process, and the OS releases it if the
+        process dies, so another worker takes over.
+        """
+        if fcntl is None:
+            self.leader = True
+            return True
+        handle = open(self.path + '.lock', 'w')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self.lock_file = handle
+        self.leader = True
+        return True
+
+    def follow(self, node):
+        """
+        Sync method.
+
+        Follows a node through the streaming API, reconnecting with backoff
+        when the connection drops. Firebase redirects streams to the shard
+        holding the data, so the access token goes in the query string rather
+        than a header that would not survive the redirect.
+        """
+        delay = 1
+        while not self.stopped.is_set():
+            try:
+                database = self.app.extensions['firebase'].database()
+                params = {}
+                if database.credentials:
+                    params['access_token'] = database.credentials.get_access_token().access_token
+                url = database.database_url + node + '.json'
+                with database.requests.get(url, params=params, headers={'Accept': 'text/event-stream'}, stream=True, timeout=(10, 90)) as response:
+                    response.raise_for_status()
+                    delay = 1
+                    event = None
+                    # chunk_size=None hands over events as they arrive rather than once a buffer fills
+                    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                        if self.stopped.is_set():
+                            return
+                        if line.startswith('event:'):
+                            event = line[6:].strip()
+                        elif line.startswith('data:'):
+                            self.handle(node, event, json.loads(line[5:].strip()))
+                        if event in ('cancel', 'auth_revoked'):
+                            # Reconnect, with a fresh token if it expired
+                            break
+            except Exception as err:
+                logger.warning('Replica stream for %s dropped: %s', node, err)
+            self.stopped.wait(delay)
+            delay = min(delay * 2, 60)
+
+    def handle(self, node, event, message):
+        """
+        Sync method.
+
+        Applies one stream event. put replaces the data at a path, patch
+        merges children into it (their keys can be paths themselves, for
+        multi-path updates), and keep-alive just shows the stream is alive.
+        """
+        connection = self.connect()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if event == 'put':
+                self.put(connection, node, message["path"], message["data"])
+            elif event == 'patch':
+                for key, value in message["data"].items():
+                    self.put(connection, node, message["path"].rstrip('/') + '/' + key, value)
+            self.mark(connection, 'heartbeat')
+
+    def put(self, connection, node, path, value):
+        """
+        Sync method.
+
+        Writes a value at a path below a node: the whole node, one record, or a field inside a record.
+        """
+        parts = [part for part in path.split('/') if part]
+        if not parts:
+            connection.execute("DELETE FROM " + node)
+            for key, record in (value or {}).items():
+                self.store(connection, node, key, record)
+            self.mark(connection, 'synced')
+            return
+        key = parts[0]
+        if len(parts) == 1:
+            record = value
+        else:
+            row = connection.execute("SELECT data FROM " + node + " WHERE id = ?", (key,)).fetchone()
+            record = json.loads(row[0]) if row else {}
+            parent = record
+            for part in parts[1:-1]:
+                if not isinstance(parent.get(part), dict):
+                    parent[part] = {}
+                parent = parent[part]
+            if value is None:
+                parent.pop(parts[-1], None)
+            else:
+                parent[parts[-1]] = value
+        self.store(connection, node, key, record)
+
+    def store(self, connection, node, key, record):
+        """
+        Sync method.
+
+        Upserts a record with its index columns, or deletes it when it is gone.
+        """
+        if not record:
+            connection.execute("DELETE FROM " + node + " WHERE id = ?", (key,))
+        elif node == "images":
+            connection.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, json.dumps(record)) + tuple(record.get(column) if isinstance(record, dict) else None for column in self.columns))
+        else:
+            connection.execute("INSERT OR REPLACE INTO " + node + " VALUES (?, ?)", (key, json.dumps(record)))
+
+    def mark(self, connection, name):
+        """
+        Sync method.
+
+        Records when the mirror last heard from Firebase.
+        """
+        connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, time.time()))
+
+    def full_sync(self):
+        """
+        Sync method.
+
+        Replaces every mirrored node with a fresh snapshot.
+        """
+        database = self.app.extensions['firebase'].database()
+        snapshots = {node: database.child(node).get().val() for node in self.nodes}
+        connection = self.connect()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for node, snapshot in snapshots.items():
+                self.put(connection, node, '/', json.loads(json.dumps(snapshot)) if snapshot else None)
+            self.mark(connection, 'heartbeat')
+
+    def is_ready(self):
+        """
+        Check method.
+
+        Returns whether the mirror holds a full snapshot and heard from the stream recently.
+        """
+        if not self.started:
+            return False
+        rows = dict(self.connect().execute("SELECT name, value FROM meta").fetchall())
+        return 'synced' in rows and time.time() - rows.get('heartbeat', 0) < self.max_lag
+
+    def wrote(self, image_id):
+        """
+        Update method.
+
+        Records that the current request wrote an image, so it and its session
+        read that image from Firebase until the mirror has caught up.
+        """
+        if not has_request_context():
+            return
+        now = time.time()
+        g.setdefault('replica_written', set()).add(image_id)
+        written = {key: stamp for key, stamp in (session.get('replica_written') or {}).items() if now - stamp < self.write_window}
+        written[image_id] = now
+        session['replica_written'] = written
+
+    def is_current(self, image_id):
+        """
+        Check method.
+
+        Returns whether the mirror's copy of an image may be shown to the current request.
+        """
+        if not has_request_context():
+            return True
+        if image_id in g.get('replica_written', ()):
+            return False
+        stamp = (session.get('replica_written') or {}).get(image_id)
+        return stamp is None or time.time() - stamp >= self.write_window
+
+    def get_feed(self, index, start, end, limit):
+        """
+        Get method.
+
+        Returns up to limit image records with start <= index <= end, highest first.
+        """
+        if index not in self.columns:
+            raise Exception("Unknown index: " + index)
+        rows = self.connect().execute(
+            "SELECT data FROM images WHERE " + index + " >= ? AND " + index + " <= ? ORDER BY " + index + " DESC LIMIT ?",
+            (start, end, limit)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_image(self, image_id):
+        """
+        Get method.
+
+        Returns an image record, or None.
+        """
+        row = self.connect().execute("SELECT data FROM images WHERE id = ?", (image_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_all_images(self):
+        """
+        Get method.
+
+        Returns every image record.
+        """
+        return [json.loads(row[0]) for row in self.connect().execute("SELECT data FROM images")]
+
+    def get_user(self, user_id):
+        """
+        Get method.
+
+        Returns a user record, or None. Mirrored data can lag writes by a
+        moment, so reads that must see a write just made go to Firebase.
+        """
+        row = self.connect().execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def stats(self):
+        """
+        Stats method.
+
+        Returns the mirror's size and freshness.
+        """
+        connection = self.connect()
+        rows = dict(connection.execute("SELECT name, value FROM meta").fetchall())
+        return {
+            "ready": self.is_ready(),
+            "leader": self.leader,
+            "images": connection.execute("SELECT COUNT(*) FROM images").fetchone()[0],
+            "users": connection.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            "synced": rows.get('synced'),
+            "heartbeat": rows.get('heartbeat')
+        }
@@ -0,0 +1,214 @@
+import re
+import math
+import heapq
+import bisect
+import unicodedata
+from app.classes.SnapshotIndex import SnapshotIndex
+
+class SearchIndex(SnapshotIndex):
+    """
+    SearchIndex Class.
+
+    In-process inverted index over the image name, description, category and
+    user name. Each term maps to the images containing it and how often,
+    weighted by field, and results are ranked with BM25. The vocabulary is
+    kept sorted, so a query word also matches every term it is a prefix of
+    ("sun" finds "sunset") with a bisect rather than a scan.
+
+    The index is built from a DB snapshot on first use and kept up to date by
+    upload, edit and delete events. Like the trending index, each worker only
+    sees its own events, so it is rebuilt in the background every `refresh`
+    seconds (see IndexLoader).
+
+    """
+
+    # Field weights: a word in the name counts three times one in the description
+    fields = {"name": 3, "category": 2, "user_name": 2, "description": 1}
+
+    # BM25 parameters
+    k1 = 1.2
+    b = 0.75
+
+    # Prefix matches count for less than the exact word, and at most this many are expanded
+    prefix_weight = 0.7
+    max_expansions = 50
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        super().__init__()
+        # term -> {image id: weighted term frequency}
+        self.postings = {}
+        # sorted list of every term, for prefix lookups
+        self.vocabulary = []
+        # image id -> (weighted length, {term: frequency}, record)
+        self.documents = {}
+        self.total_length = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the refresh interval from the Flask app and registers the index.
+        """
+        app.config.setdefault('SEARCH_REFRESH', 300)
+        self.register(app, app.config['SEARCH_REFRESH'])
+        app.extensions['search'] = self
+
+    def tokenise(self, text):
+        """
+        Tokenise method.
+
+        Splits text into lowercase words with accents removed, e.g. "Café-Life" -> ["cafe", "life"].
+        """
+        text = unicodedata.normalize("NFKD", str(text or "").lower())
+        text = "".join(character for character in text if not unicodedata.combining(character))
+        return re.findall(r"[^\W_]+", text)
+
+    def rebuild(self, records):
+        """
+        Load method.
+
+        Replaces the index with the given records. Called with the lock held.
+        """
+        self.postings = {}
+        self.vocabulary = []
+        self.documents = {}
+        self.total_length = 0
+        for record in records:
+            if record.get("id"):
+                self.index(record, keep_sorted=False)
+        # One sort for the whole vocabulary rather than an insertion per term
+        self.vocabulary = sorted(self.postings)
+
+    def index(self, record, keep_sorted=True):
+        """
+        Index method.
+
+        Adds or re-indexes a record. Called with the lock held; bulk loads
+        pass keep_sorted=False and sort the vocabulary once at the end.
+        """
+        self.unindex(record["id"])
+        frequencies = {}
+        for field, weight in self.fields.items():
+            for term in self.tokenise(record.get(field)):
+                frequencies[term] = frequencies.get(term, 0) + weight
+        for term, frequency in frequencies.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                if keep_sorted:
+                    bisect.insort(self.vocabulary, term)
+            self.postings[term][record["id"]] = frequency
+        length = sum(frequencies.values())
+        self.documents[record["id"]] = (length, frequencies, record)
+        self.total_length += length
+
+    def unindex(self, image_id):
+        """
+        Index method.
+
+        Removes a record from the index, if it is there. Called with the lock held.
+        """
+        document = self.documents.pop(image_id, None)
+        if document is None:
+            return
+        length, frequencies, record = document
+        self.total_length -= length
+        for term in frequencies:
+            postings = self.postings[term]
+            del postings[image_id]
+            if not postings:
+                del self.postings[term]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+
+    def add(self, record):
+        """
+        Event method.
+
+        Indexes a new image.
+        """
+        with self.lock:
+            self.changed("add", dict(record))
+            if self.loaded is not None:
+                self.index(dict(record))
+
+    def update(self, image_id, fields):
+        """
+        Event method.
+
+        Applies changed fields to an image, e.g. after an edit, and re-indexes it.
+        """
+        with self.lock:
+            self.changed("update", image_id, dict(fields))
+            document = self.documents.get(image_id)
+            if document is not None:
+                record = dict(document[2])
+                record.update(fields)
+                self.index(record)
+
+    def remove(self, image_id):
+        """
+        Event method.
+
+        Drops a deleted image.
+        """
+        with self.lock:
+            self.changed("remove", image_id)
+            self.unindex(image_id)
+
+    def expand(self, word):
+        """
+        Search method.
+
+        Returns the indexed terms matching a query word: (term, weight) for the
+        word itself and for terms it is a prefix of.
+        """
+        matches = []
+        if word in self.postings:
+            matches.append((word, 1.0))
+        start = bisect.bisect_right(self.vocabulary, word)
+        for term in self.vocabulary[start:start + self.max_expansions]:
+            if not term.startswith(word):
+                break
+            matches.append((term, self.prefix_weight))
+        return matches
+
+    def search(self, query, limit=20, offset=0):
+        """
+        Search method.
+
+        Returns a page of records matching the query, best first, with the
+        offset of the next page (None on the last page).
+        """
+        self.ensure_loaded()
+        words = list(dict.fromkeys(self.tokenise(query)))
+        with self.lock:
+            count = len(self.documents)
+            if not words or not count:
+                return [], None
+            average_length = self.total_length / count
+            scores = {}
+            for word in words:
+                # Each query word counts once per image, through its best matching term
+                best = {}
+                for term, weight in self.expand(word):
+                    postings = self.postings[term]
+                    idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for image_id, frequency in postings.items():
+                        length = self.documents[image_id][0]
+                        score = weight * idf * frequency * (self.k1 + 1) / (frequency + self.k1 * (1 - self.b + self.b * length / average_length))
+                        if score > best.get(image_id, 0):
+                            best[image_id] = score
+                for image_id, score in best.items():
+                    scores[image_id] = scores.get(image_id, 0) + score
+
+            # Only the results up to the end of the page need ordering
+            ranked = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))
+            page = ranked[offset:offset + limit]
+            records = [dict(self.documents[image_id][2], search_score=score) for image_id, score in page]
+            next_offset = offset + limit if offset + limit < len(scores) else None
+        return records, next_offset
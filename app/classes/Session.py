@@ -0,0 +1,207 @@
+import os
+import secrets
+from flask.json.tag import JSONTag, TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from app.classes.SessionBackend import MemorySessionBackend, SQLiteSessionBackend
+
+class TagSet(JSONTag):
+    """
+    TagSet Class.
+
+    Lets sets, such as a user's likes, be stored in sessions.
+
+    """
+    key = " s"
+
+    def check(self, value):
+        return isinstance(value, (set, frozenset))
+
+    def to_json(self, value):
+        return sorted(self.serializer.tag(item) for item in value)
+
+    def to_python(self, value):
+        return set(value)
+
+
+class ServerSession(SessionMixin):
+    """
+    ServerSession Class.
+
+    Session whose data lives in a server-side backend. The cookie only holds
+    an opaque id, and the data is only read from the backend the first time
+    the request touches the session.
+
+    """
+
+    def __init__(self, sid, loader=None):
+        self.sid = sid
+        self.loader = loader
+        self.data = None
+        self.stored = None
+        self.previous_sid = None
+        self.modified = False
+        self.accessed = False
+
+    def load(self):
+        """
+        Load method.
+
+        Reads the session data from the backend on first access.
+        """
+        self.accessed = True
+        if self.data is None:
+            self.stored, self.data = self.loader(self.sid) if self.loader else (None, {})
+            if self.stored is None:
+                # Unknown or expired id: never adopt an id chosen by the client
+                self.sid = secrets.token_urlsafe(32)
+        return self.data
+
+    def regenerate(self):
+        """
+        Regenerate method.
+
+        Moves the session to a new id, e.g. on login, so an id obtained before
+        logging in cannot be used to ride the logged in session.
+        """
+        self.load()
+        if self.previous_sid is None and self.stored is not None:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.stored = None
+        self.modified = True
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __setitem__(self, key, value):
+        self.load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.load()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def __repr__(self):
+        return '<ServerSession {0!r}>'.format(self.load())
+
+
+class Sessions(SessionInterface):
+    """
+    Sessions Class.
+
+    Server-side session store. Instead of the signed cookie carrying the
+    whole user profile, the cookie holds a random session id and the data is
+    kept in a backend: "memory" per process for development, "sqlite" shared
+    by every worker on the host. Sessions are only written back when their
+    content changed, so nested changes (e.g. to the user's likes) are saved
+    without having to flag them.
+
+    """
+
+    backends = {
+        "memory": lambda app: MemorySessionBackend(),
+        "sqlite": lambda app: SQLiteSessionBackend(app.config['SESSION_PATH']),
+    }
+
+    serializer = TaggedJSONSerializer()
+    serializer.register(TagSet)
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the session backend from the Flask app and installs the session interface.
+        """
+        app.config.setdefault('SESSION_BACKEND', 'memory')
+        app.config.setdefault('SESSION_PATH', os.path.join(app.instance_path, 'sessions.sqlite3'))
+        if app.config['SESSION_BACKEND'] not in self.backends:
+            raise Exception("Unknown session backend: " + app.config['SESSION_BACKEND'])
+        self.backend = self.backends[app.config['SESSION_BACKEND']](app)
+        app.session_interface = self
+        app.extensions['sessions'] = self
+
+    def open_session(self, app, request):
+        """
+        Open method.
+
+        Returns the request's session, without reading the backend yet.
+        """
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return ServerSession(None)
+        return ServerSession(sid, self.load)
+
+    def load(self, sid):
+        """
+        Load method.
+
+        Returns a session's stored string and its data.
+        """
+        stored = self.backend.get(sid)
+        if stored is None:
+            return None, {}
+        return stored, self.serializer.loads(stored)
+
+    def save_session(self, app, session, response):
+        """
+        Save method.
+
+        Writes the session back if it changed, and sets or removes the id cookie.
+        """
+        if not session.accessed:
+            return
+        response.vary.add("Cookie")
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid:
+            self.backend.delete(session.previous_sid)
+
+        if not session:
+            # Emptied, e.g. on logout: forget it on both sides
+            if session.stored is not None:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        data = self.serializer.dumps(dict(session.data))
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        if data != session.stored or self.should_set_cookie(app, session):
+            self.backend.set(session.sid, data, lifetime)
+        if session.stored is None or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def stats(self):
+        """
+        Stats method.
+
+        Returns the backend's session count.
+        """
+        stats = self.backend.stats()
+        stats["backend"] = type(self.backend).__name__
+        return stats
@@ -0,0 +1,154 @@
+import os
+import time
+import sqlite3
+import threading
+
+class SessionBackend():
+    """
+    SessionBackend Class.
+
+    Storage interface used by the server-side sessions. Each session is a
+    serialised string stored under its opaque id until it expires.
+
+    """
+
+    def get(self, sid):
+        """
+        Get method.
+
+        Returns the stored session data, or None if it is missing or expired.
+        """
+        raise NotImplementedError
+
+    def set(self, sid, data, ttl):
+        """
+        Set method.
+
+        Stores session data for ttl seconds.
+        """
+        raise NotImplementedError
+
+    def delete(self, sid):
+        """
+        Delete method.
+
+        Drops a session.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Stats method.
+
+        Returns the number of stored sessions.
+        """
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SessionBackend):
+    """
+    MemorySessionBackend Class.
+
+    Per-process backend for development: sessions are lost on restart and not
+    shared between workers.
+
+    """
+
+    # Expired sessions are swept after this many writes
+    sweep_every = 1000
+
+    def __init__(self):
+        self.sessions = {}
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.sessions.get(sid)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.sessions[sid]
+                return None
+            return entry[1]
+
+    def set(self, sid, data, ttl):
+        with self.lock:
+            now = time.time()
+            self.sessions[sid] = (now + ttl, data)
+            self.writes += 1
+            if self.writes % self.sweep_every == 0:
+                for expired in [key for key, entry in self.sessions.items() if entry[0] < now]:
+                    del self.sessions[expired]
+
+    def delete(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.sessions)}
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    SQLiteSessionBackend Class.
+
+    Host-wide backend on a shared SQLite file, so a user stays logged in
+    whichever worker process handles their request.
+
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT, expires REAL);
+        CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+    """
+
+    # Expired sessions are swept after this many writes
+    sweep_every = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.writes = 0
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connect() as connection:
+            connection.executescript(self.schema)
+
+    def connect(self):
+        """
+        Connect method.
+
+        Returns this thread's connection, reopening it after a fork so worker
+        processes never share a SQLite handle.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def get(self, sid):
+        row = self.connect().execute("SELECT data, expires FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def set(self, sid, data, ttl):
+        connection = self.connect()
+        now = time.time()
+        connection.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (sid, data, now + ttl))
+        self.writes += 1
+        if self.writes % self.sweep_every == 0:
+            connection.execute("DELETE FROM sessions WHERE expires < ?", (now,))
+
+    def delete(self, sid):
+        self.connect().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def stats(self):
+        return {"size": self.connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]}
@@ -0,0 +1,191 @@
+from app.classes.SnapshotIndex import SnapshotIndex
+
+class SimilarityIndex(SnapshotIndex):
+    """
+    SimilarityIndex Class.
+
+    In-process BK-tree over the images' 64-bit perceptual hashes (phash).
+    Every child of a node sits at a known Hamming distance from it, so by the
+    triangle inequality a query within radius r only has to descend into
+    children at distance d - r to d + r, and most of the tree is never
+    visited. Near-duplicates additionally need a close dhash, which catches
+    the rare images whose phash collides by chance.
+
+    Like the other in-process indexes it is built from a DB snapshot, kept up
+    to date by upload, edit and delete events, and rebuilt in the background
+    every `refresh` seconds to pick up other workers' changes.
+
+    """
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        super().__init__()
+        # Nodes are [hash, {image ids}, {distance: child node}]
+        self.root = None
+        # image id -> record
+        self.records = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the distance thresholds and refresh interval from the Flask app and registers the index.
+        """
+        app.config.setdefault('SIMILAR_DISTANCE', 12)
+        app.config.setdefault('DUPLICATE_DISTANCE', 6)
+        app.config.setdefault('SIMILARITY_REFRESH', 300)
+        self.similar_distance = app.config['SIMILAR_DISTANCE']
+        self.duplicate_distance = app.config['DUPLICATE_DISTANCE']
+        self.register(app, app.config['SIMILARITY_REFRESH'])
+        app.extensions['similarity'] = self
+
+    def distance(self, first, second):
+        """
+        Distance method.
+
+        Returns the Hamming distance between two hashes.
+        """
+        return bin(first ^ second).count('1')
+
+    def rebuild(self, records):
+        """
+        Load method.
+
+        Replaces the tree with the given records. Called with the lock held.
+        """
+        self.root = None
+        self.records = {}
+        for record in records:
+            if record.get("id"):
+                self.insert(record)
+
+    def insert(self, record):
+        """
+        Index method.
+
+        Adds a record to the tree, if it has been hashed. Called with the lock held.
+        """
+        self.delete(record["id"])
+        if not record.get("phash"):
+            return
+        value = int(record["phash"], 16)
+        self.records[record["id"]] = record
+        if self.root is None:
+            self.root = [value, {record["id"]}, {}]
+            return
+        node = self.root
+        while True:
+            distance = self.distance(value, node[0])
+            if distance == 0:
+                node[1].add(record["id"])
+                return
+            if distance not in node[2]:
+                node[2][distance] = [value, {record["id"]}, {}]
+                return
+            node = node[2][distance]
+
+    def delete(self, image_id):
+        """
+        Index method.
+
+        Removes a record from the tree. Its node stays behind to route lookups,
+        holding no images, until the next rebuild. Called with the lock held.
+        """
+        record = self.records.pop(image_id, None)
+        if record is None:
+            return
+        value = int(record["phash"], 16)
+        node = self.root
+        while node is not None:
+            distance = self.distance(value, node[0])
+            if distance == 0:
+                node[1].discard(image_id)
+                return
+            node = node[2].get(distance)
+
+    def add(self, record):
+        """
+        Event method.
+
+        Indexes a new image.
+        """
+        with self.lock:
+            self.changed("add", dict(record))
+            if self.loaded is not None:
+                self.insert(dict(record))
+
+    def update(self, image_id, fields):
+        """
+        Event method.
+
+        Applies changed fields to an image, e.g. after an edit.
+        """
+        with self.lock:
+            self.changed("update", image_id, dict(fields))
+            record = self.records.get(image_id)
+            if record is not None:
+                record = dict(record)
+                record.update(fields)
+                self.insert(record)
+
+    def remove(self, image_id):
+        """
+        Event method.
+
+        Drops a deleted image.
+        """
+        with self.lock:
+            self.changed("remove", image_id)
+            self.delete(image_id)
+
+    def query(self, phash, radius):
+        """
+        Search method.
+
+        Returns (distance, record) for every image whose phash is within radius of the given one, closest first.
+        """
+        self.ensure_loaded()
+        value = int(phash, 16)
+        found = []
+        with self.lock:
+            pending = [self.root] if self.root is not None else []
+            while pending:
+                node = pending.pop()
+                distance = self.distance(value, node[0])
+                if distance <= radius:
+                    found.extend((distance, self.records[image_id]) for image_id in node[1])
+                for child_distance, child in node[2].items():
+                    if distance - radius <= child_distance <= distance + radius:
+                        pending.append(child)
+        found.sort(key=lambda match: (match[0], match[1]["id"]))
+        return found
+
+    def similar(self, record, limit=8):
+        """
+        Search method.
+
+        Returns the records most visually similar to an image, excluding itself.
+        """
+        if not record.get("phash"):
+            return []
+        matches = self.query(record["phash"], self.similar_distance)
+        return [dict(match, distance=distance) for distance, match in matches if match["id"] != record["id"]][:limit]
+
+    def duplicates(self, record):
+        """
+        Search method.
+
+        Returns the records that look like the same picture as an image, e.g.
+        resized or saved in another format, excluding itself.
+        """
+        if not record.get("phash") or not record.get("dhash"):
+            return []
+        dhash = int(record["dhash"], 16)
+        return [dict(match, distance=distance) for distance, match in self.query(record["phash"], self.duplicate_distance)
+                if match["id"] != record["id"] and match.get("dhash")
+                and self.distance(dhash, int(match["dhash"], 16)) <= 2 * self.duplicate_distance]
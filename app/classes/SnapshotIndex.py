@@ -0,0 +1,106 @@
+import time
+import threading
+
+class SnapshotIndex():
+    """
+    SnapshotIndex Class.
+
+    Base of the in-process indexes built from a snapshot of every image and
+    kept up to date by upload, edit, like and delete events. Loading is left
+    to the IndexLoader, which reads the snapshot once for every index and
+    reloads them off the request path. Events arriving while a snapshot is
+    being read are recorded and replayed on top of it, so none are lost to
+    the reload. Events that set state (add, update, remove) are replayed
+    whenever they were recorded. Increments, listed in `increments`, are
+    only replayed when recorded after the snapshot was read: one recorded
+    before may already be in it. An increment written while the snapshot
+    was being read is therefore missed until the next reload, rather than
+    counted twice.
+
+    Subclasses implement rebuild(records), and call changed() from their
+    event methods with the lock held.
+
+    """
+
+    # Events applying a delta rather than setting state
+    increments = ()
+
+    def __init__(self):
+        """
+        Initialise class with configuration
+
+        """
+        self.loaded = None
+        self.refresh = 300
+        self.loader = None
+        # (time, event, args) since the snapshot being loaded was requested, or None when not loading
+        self.replay = None
+        self.lock = threading.RLock()
+
+    def register(self, app, refresh):
+        """
+        Register method.
+
+        Sets the refresh interval and hands the index to the app's IndexLoader.
+        """
+        self.refresh = refresh
+        self.loader = app.extensions['index_loader']
+        self.loader.register(self)
+
+    def ensure_loaded(self):
+        """
+        Load method.
+
+        Loads the index on first use. Later reloads happen in the background.
+        """
+        if self.loaded is None:
+            self.loader.ensure_loaded(self)
+
+    def begin(self):
+        """
+        Load method.
+
+        Starts recording events, before the snapshot is read.
+        """
+        with self.lock:
+            self.replay = []
+
+    def abort(self):
+        """
+        Load method.
+
+        Stops recording events after a failed read.
+        """
+        with self.lock:
+            self.replay = None
+
+    def changed(self, event, *args):
+        """
+        Event method.
+
+        Records an event for replay while a snapshot is loading. Called with the lock held.
+        """
+        if self.replay is not None:
+            self.replay.append((time.time(), event, args))
+
+    def reload(self, records, read_at):
+        """
+        Load method.
+
+        Rebuilds the index from a snapshot read at read_at, then replays the events that arrived meanwhile.
+        """
+        with self.lock:
+            replay, self.replay = self.replay or [], None
+            self.rebuild(records)
+            self.loaded = time.time()
+            for recorded, event, args in replay:
+                if event not in self.increments or recorded >= read_at:
+                    getattr(self, event)(*args)
+
+    def rebuild(self, records):
+        """
+        Load method.
+
+        Replaces the index contents with the given records. Called with the lock held.
+        """
+        raise NotImplementedError
@@ -0,0 +1,160 @@
+import math
+import bisect
+from app.classes.SnapshotIndex import SnapshotIndex
+
+class TrendingIndex(SnapshotIndex):
+    """
+    TrendingIndex Class.
+
+    In-process ranking of images by a time-decayed popularity score:
+
+        score = log10(max(likes, 1)) + created_at / gravity
+
+    Ten times the likes is worth `gravity` seconds of recency, so new images
+    overtake older ones unless those keep earning likes. The time term only
+    depends on when the image was created, so scores never have to be
+    recomputed as time passes: only a like, upload, edit or delete moves an
+    image, with a binary search for its place and a list insertion, which is
+    O(n) but a single memmove. Serving the top N is a slice of the sorted
+    list.
+
+    Every worker keeps its own index and only sees its own events, so the
+    index is rebuilt from the DB in the background every `refresh` seconds to
+    pick up the rest (see IndexLoader).
+
+    """
+
+    # Likes add a delta, so replaying one the snapshot already holds would count it twice
+    increments = ("like",)
+
+    def __init__(self, app=None):
+        """
+        Initialise class with configuration
+
+        """
+        super().__init__()
+        # (-score, image id), best first
+        self.ranking = []
+        # image id -> (score, record)
+        self.records = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Init method.
+
+        Reads the gravity and refresh interval from the Flask app and registers the index.
+        """
+        app.config.setdefault('TRENDING_GRAVITY', 45000)
+        app.config.setdefault('TRENDING_REFRESH', 300)
+        self.gravity = app.config['TRENDING_GRAVITY']
+        self.register(app, app.config['TRENDING_REFRESH'])
+        app.extensions['trending'] = self
+
+    def score(self, record):
+        """
+        Score method.
+
+        Returns the trending score of an image record.
+        """
+        likes = max(record.get("like_count") or 0, 1)
+        return math.log10(likes) + int(record.get("created_at") or 0) / self.gravity
+
+    def rebuild(self, records):
+        """
+        Load method.
+
+        Replaces the ranking with the given records. Called with the lock held.
+        """
+        self.ranking = []
+        self.records = {}
+        for record in records:
+            if record.get("id"):
+                self.place(record)
+
+    def place(self, record):
+        """
+        Index method.
+
+        Inserts or moves a record to its place in the ranking. Called with the lock held.
+        """
+        self.unplace(record["id"])
+        score = self.score(record)
+        bisect.insort(self.ranking, (-score, record["id"]))
+        self.records[record["id"]] = (score, record)
+
+    def unplace(self, image_id):
+        """
+        Index method.
+
+        Takes a record out of the ranking, if it is there. Called with the lock held.
+        """
+        entry = self.records.pop(image_id, None)
+        if entry is None:
+            return None
+        position = bisect.bisect_left(self.ranking, (-entry[0], image_id))
+        del self.ranking[position]
+        return entry[1]
+
+    def add(self, record):
+        """
+        Event method.
+
+        Ranks a new image.
+        """
+        with self.lock:
+            self.changed("add", dict(record))
+            if self.loaded is not None:
+                self.place(dict(record))
+
+    def update(self, image_id, fields):
+        """
+        Event method.
+
+        Applies changed fields to an image, e.g. after an edit, and re-ranks it.
+        """
+        with self.lock:
+            self.changed("update", image_id, dict(fields))
+            entry = self.records.get(image_id)
+            if entry is not None:
+                record = dict(entry[1])
+                record.update(fields)
+                self.place(record)
+
+    def like(self, image_id, delta):
+        """
+        Event method.
+
+        Adjusts an image's like count and re-ranks it.
+        """
+        with self.lock:
+            self.changed("like", image_id, delta)
+            entry = self.records.get(image_id)
+            if entry is not None:
+                record = dict(entry[1])
+                record["like_count"] = max((record.get("like_count") or 0) + delta, 0)
+                self.place(record)
+
+    def remove(self, image_id):
+        """
+        Event method.
+
+        Drops a deleted image.
+        """
+        with self.lock:
+            self.changed("remove", image_id)
+            self.unplace(image_id)
+
+    def top(self, limit=20, offset=0):
+        """
+        Get method.
+
+        Returns a page of records, best first, with the offset of the next page (None on the last page).
+        """
+        self.ensure_loaded()
+        with self.lock:
+            page = self.ranking[offset:offset + limit]
+            records = [dict(self.records[image_id][1], trending_score=-score) for score, image_id in page]
+            next_offset = offset + limit if offset + limit < len(self.ranking) else None
+        return records, next_offset
@@ -1,24 +1,350 @@
 import os
+import glob
+import hashlib
+import struct
+import tempfile
+import numpy as np
 from flask import Flask, flash, request, redirect, url_for
 from flask import current_app as flask_app
+from PIL import Image as PILImage
+from PIL import features
+from werkzeug.security import safe_join
 from app import SITE_ROOT
 
 class Upload():
 
     def __init__(self):
         self.extensions = {'png', 'jpg', 'jpeg', 'gif'}
+        self.chunk_size = 64 * 1024
+        # How much of the file may be read looking for the dimensions (JPEG metadata can be long)
+        self.header_limit = 1024 * 1024
+        # Widths of the derivatives generated for each upload
+        self.widths = [320, 640, 1280]
+        # Modern formats transcoded alongside each upload, most compact first: (extension, mimetype, Pillow format, options)
+        self.modern_formats = [
+            ('avif', 'image/avif', 'AVIF', {'quality': 60}),
+            ('webp', 'image/webp', 'WEBP', {'quality': 80, 'method': 4}),
+        ]
 
-    def upload(self, file, filename):
+    def upload(self, file, max_bytes, max_pixels=None, perceptual=True):
+        """
+        Upload method.
+
+        Streams an upload to disk in fixed-size chunks and stores it under its
+        content hash (static/uploads/<2 hex>/<sha256>.<ext>), so identical
+        uploads share one file on disk. The type is sniffed from the magic bytes
+        of the first chunk and the dimensions read from the header as it
+        arrives; the upload is aborted as soon as it is not an image, is
+        larger than max_bytes, or would decode to more than max_pixels.
+        Unless perceptual is False, the image's perceptual hashes are computed
+        once it is stored, for near-duplicate and similarity lookups.
+
+        Returns:
+        dict: location (relative to the app), blob hash, width, height, bytes and perceptual hashes
+        """
         allowed_extension = self.allowed_file(file.filename)
-        if allowed_extension:
-            fullname = filename + '.' + allowed_extension
-            destination = os.path.join('static/uploads', fullname)
-            file.save(os.path.join(SITE_ROOT, destination))
-            return destination
-        else:
-            raise Exception("Only allowed filetypes: ".join(self.extensions.values()))
+        if not allowed_extension:
+            raise Exception("Only allowed filetypes: " + ", ".join(sorted(self.extensions)))
+        max_pixels = max_pixels or PILImage.MAX_IMAGE_PIXELS
+
+        uploads = os.path.join(SITE_ROOT, 'static/uploads')
+        handle, temporary = tempfile.mkstemp(dir=uploads, prefix='.upload-')
+        digest = hashlib.sha256()
+        kind = None
+        header = b''
+        dimensions = None
+        size = 0
+        try:
+            with os.fdopen(handle, 'wb') as output:
+                while True:
+                    chunk = file.stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise Exception("This image is too large. The limit is {0:.1f} MB.".format(max_bytes / (1024 * 1024)))
+                    if kind is None:
+                        # The extension is only a hint: the content decides what is stored
+                        kind = self.sniff(chunk)
+                        if kind is None:
+                            raise Exception("This file is not a supported image.")
+                    if dimensions is None and len(header) < self.header_limit:
+                        header += chunk
+                        dimensions = self.dimensions(kind, header)
+                        if dimensions and dimensions[0] * dimensions[1] > max_pixels:
+                            raise Exception("This image has too many pixels.")
+                    digest.update(chunk)
+                    output.write(chunk)
+
+            if dimensions is None:
+                raise Exception("This file is not a supported image.")
+
+            directory = os.path.join('static/uploads', digest.hexdigest()[:2])
+            os.makedirs(os.path.join(SITE_ROOT, directory), exist_ok=True)
+            existing = self.find_blob(directory, digest.hexdigest())
+            if existing:
+                # Duplicate content: keep the existing blob, whatever extension it was uploaded with
+                os.remove(temporary)
+                destination = existing
+            else:
+                destination = os.path.join(directory, digest.hexdigest() + '.' + kind)
+                os.replace(temporary, os.path.join(SITE_ROOT, destination))
+        except Exception:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return {
+            "location": destination,
+            "blob": digest.hexdigest(),
+            "width": dimensions[0],
+            "height": dimensions[1],
+            "bytes": size,
+            "hashes": self.perceptual_hashes(destination) if perceptual else {}
+        }
+
+    def perceptual_hashes(self, location):
+        """
+        Hash method.
+
+        Computes 64-bit perceptual hashes of an image, as 16 hex digits. Unlike
+        the content hash they barely change when an image is resized,
+        recompressed or converted, so near-duplicates are a few bits apart:
+        ahash compares each pixel of an 8x8 thumbnail to the mean, dhash each
+        pixel to its neighbour, and phash the low frequencies of a 32x32 DCT
+        to their median.
+
+        Returns:
+        dict: ahash, dhash and phash
+        """
+        source = os.path.join(SITE_ROOT, location.strip('/'))
+        with PILImage.open(source) as original:
+            # JPEGs can be decoded at a fraction of their size, which is all the hashes need
+            original.draft('L', (128, 128))
+            # Palette images may carry transparency, which only converts cleanly through RGBA
+            grey = (original.convert('RGBA') if original.mode == 'P' else original).convert('L')
+
+        def thumbnail(width, height):
+            return np.asarray(grey.resize((width, height), PILImage.LANCZOS), dtype=np.float64)
+
+        def to_hex(bits):
+            return '{0:016x}'.format(int(''.join('1' if bit else '0' for bit in bits.flatten()), 2))
+
+        average = thumbnail(8, 8)
+        difference = thumbnail(9, 8)
+        pixels = thumbnail(32, 32)
+        # Orthonormal DCT-II matrix, applied to rows and columns
+        n = np.arange(32)
+        dct = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / 64) * np.sqrt(2 / 32)
+        dct[0] /= np.sqrt(2)
+        frequencies = (dct @ pixels @ dct.T)[:8, :8]
+        # The DC term is the overall brightness, so it is left out of the median
+        median = np.median(frequencies.flatten()[1:])
+        return {
+            "ahash": to_hex(average > average.mean()),
+            "dhash": to_hex(difference[:, 1:] > difference[:, :-1]),
+            "phash": to_hex(frequencies > median)
+        }
+
+    def sniff(self, chunk):
+        """
+        Sniff method.
+
+        Returns the image type from the magic bytes at the start of a file, or None.
+        """
+        if chunk.startswith(b'\x89PNG\r\n\x1a\n'):
+            return 'png'
+        if chunk.startswith(b'\xff\xd8\xff'):
+            return 'jpg'
+        if chunk.startswith((b'GIF87a', b'GIF89a')):
+            return 'gif'
+        return None
+
+    def dimensions(self, kind, header):
+        """
+        Dimensions method.
+
+        Reads (width, height) from the bytes received so far, or returns None
+        when more of the header is needed.
+        """
+        if kind == 'png':
+            # IHDR is always the first chunk
+            if len(header) < 24:
+                return None
+            return struct.unpack('>II', header[16:24])
+        if kind == 'gif':
+            if len(header) < 10:
+                return None
+            return struct.unpack('<HH', header[6:10])
+        # JPEG: walk the segments until a start-of-frame marker
+        offset = 2
+        while offset + 4 <= len(header):
+            if header[offset] != 0xFF:
+                raise Exception("This file is not a supported image.")
+            marker = header[offset + 1]
+            if marker == 0xFF:
+                # Fill byte
+                offset += 1
+                continue
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                offset += 2
+                continue
+            length = struct.unpack('>H', header[offset + 2:offset + 4])[0]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                if offset + 9 > len(header):
+                    return None
+                height, width = struct.unpack('>HH', header[offset + 5:offset + 9])
+                return width, height
+            offset += 2 + length
+        return None
+
+    def find_blob(self, directory, digest):
+        """
+        Get method.
+
+        Returns the location of the blob stored for a content hash, if any.
+        """
+        for path in glob.glob(os.path.join(SITE_ROOT, directory, digest + '.*')):
+            # Skips derivative copies such as <digest>.png.webp
+            if os.path.splitext(os.path.basename(path))[0] == digest:
+                return os.path.join(directory, os.path.basename(path))
+        return None
+
+    def remove_blob(self, location, retained=None):
+        """
+        Remove method.
+
+        Unlinks a blob along with its derivatives and modern format copies.
+        With retained, the blob is first moved out of place and retained() is
+        asked again: if an upload of the same content referenced the blob in
+        the meantime, it is put back instead. That upload checks the blob is
+        still in place after referencing it (see exists), so between them one
+        of the two notices.
+        """
+        source = os.path.join(SITE_ROOT, location.strip('/'))
+        base, extension = os.path.splitext(source)
+        if retained is not None:
+            removing = base + '.removing'
+            try:
+                os.replace(source, removing)
+            except FileNotFoundError:
+                return
+            if retained():
+                os.replace(removing, source)
+                return
+        for path in glob.glob(glob.escape(base) + '*'):
+            os.remove(path)
+
+    def exists(self, location):
+        """
+        Check method.
+
+        Returns whether a stored upload is in place on disk.
+        """
+        return os.path.exists(os.path.join(SITE_ROOT, location.strip('/')))
+
+    def make_derivatives(self, location):
+        """
+        Derivatives method.
+
+        Writes a downscaled copy of an upload for each configured width smaller
+        than the original, next to it in static/uploads.
+
+        Returns:
+        list: {"width", "location"} dicts, narrowest first, ending with the original
+        """
+        source = os.path.join(SITE_ROOT, location.strip('/'))
+        base, extension = os.path.splitext(location.strip('/'))
+        sizes = []
+        with PILImage.open(source) as original:
+            # Animated gifs would lose their frames, so they are served as uploaded
+            if getattr(original, 'is_animated', False):
+                return sizes
+            for width in self.widths:
+                if width >= original.width:
+                    break
+                height = round(original.height * width / original.width)
+                destination = '{0}-{1}w{2}'.format(base, width, extension)
+                sizes.append({"width": width, "location": '/' + destination})
+                if os.path.exists(os.path.join(SITE_ROOT, destination)):
+                    # Already generated for an identical upload
+                    continue
+                resized = original.resize((width, height), PILImage.LANCZOS)
+                if extension.lower() in ('.jpg', '.jpeg') and resized.mode != 'RGB':
+                    resized = resized.convert('RGB')
+                resized.save(os.path.join(SITE_ROOT, destination), optimize=True, quality=85)
+            sizes.append({"width": original.width, "location": '/' + location.strip('/')})
+        return sizes
+
+    def available_formats(self):
+        """
+        Formats method.
+
+        Returns the modern formats this Pillow build can encode.
+        """
+        available = []
+        for modern_format in self.modern_formats:
+            try:
+                if features.check(modern_format[0]):
+                    available.append(modern_format)
+            except ValueError:
+                # Older Pillow builds do not know the feature at all
+                pass
+        return available
+
+    def accepted_formats(self, accept):
+        """
+        Formats method.
+
+        Returns the available modern formats the client explicitly accepts.
+        Wildcards are ignored: browsers without WebP/AVIF support still send image/*.
+        """
+        accepted = [value for value in accept.values()]
+        return [modern_format for modern_format in self.available_formats() if modern_format[1] in accepted]
+
+    def transcode(self, location):
+        """
+        Transcode method.
+
+        Writes a copy of an image in each available modern format next to it,
+        named after the full filename (e.g. x.png.webp) so uploads sharing a
+        basename never collide. The original is left untouched.
+
+        Returns:
+        list: locations of the copies written
+        """
+        source = os.path.join(SITE_ROOT, location.strip('/'))
+        written = []
+        with PILImage.open(source) as original:
+            # Animated gifs are served as uploaded
+            if getattr(original, 'is_animated', False):
+                return written
+            image = original.convert('RGBA' if 'A' in original.getbands() or 'transparency' in original.info else 'RGB')
+            for extension, mimetype, image_format, options in self.available_formats():
+                if not os.path.exists(source + '.' + extension):
+                    image.save(source + '.' + extension, image_format, **options)
+                written.append('/' + location.strip('/') + '.' + extension)
+        return written
+
+    def negotiate(self, filename, accept):
+        """
+        Negotiate method.
+
+        Picks the smallest stored variant of an upload the client accepts.
+
+        Returns:
+        tuple: (path, mimetype), or None if the upload does not exist
+        """
+        path = safe_join(os.path.join(SITE_ROOT, 'static/uploads'), filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        best = (os.path.getsize(path), path, None)
+        for extension, mimetype, image_format, options in self.accepted_formats(accept):
+            variant = path + '.' + extension
+            if os.path.isfile(variant) and os.path.getsize(variant) < best[0]:
+                best = (os.path.getsize(variant), variant, mimetype)
+        return best[1], best[2]
 
     def allowed_file(self, filename):
         if ('.' in filename and filename.rsplit('.', 1)[1].lower() in self.extensions):
             return filename.rsplit('.', 1)[1].lower()
-        return False
\ No newline at end of file
+        return False
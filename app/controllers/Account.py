@@ -1,6 +1,7 @@
 from flask import Blueprint, flash, redirect, render_template, request, url_for, session, jsonify
 from flask import current_app as flask_app
 from app.models.Account import Account
+from app.classes.Database import Database
 
 bp = Blueprint('account', __name__, url_prefix='', static_folder='../static')
 
@@ -79,9 +80,6 @@ def like():
 
     image_id = request.args.get('image_id')
     like = request.args.get('like')
-    flask_app.logger.info('## LIKE VAL CT ##')
-    flask_app.logger.info(request.args.get('like'))
-    flask_app.logger.info(like)
     response = ''
 
     try:
@@ -91,3 +89,22 @@ def like():
         response = str(err)
     
     return jsonify(response)
+
+
+@bp.route('/likes', methods=['POST'])
+def likes():
+    """
+    Applies a batch of like toggles sent by the client, as {"likes": {image_id: true|false}}.
+    """
+    changes = (request.get_json(silent=True) or {}).get('likes')
+    if (not isinstance(changes, dict) or len(changes) > 100 or
+            not all(Database.valid_key(image_id) and isinstance(liked, bool) for image_id, liked in changes.items())):
+        return jsonify({"error": "Expected {\"likes\": {image_id: true|false}} for at most 100 valid image ids."}), 400
+
+    try:
+        account = Account()
+        response = account.toggle_likes(changes)
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+    return jsonify(response)
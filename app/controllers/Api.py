@@ -0,0 +1,105 @@
+from app.models.Image import Image
+from flask import Blueprint, jsonify, request, url_for
+from flask import current_app as flask_app
+
+# Served under /api/v1, and under /api as the latest version (see router)
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Fields a client may read. Internal keys (blob references, hashes, sort keys, user ids) are never sent.
+public_fields = ("id", "name", "description", "category", "filter", "status", "upload_location", "sizes",
+                 "user_name", "user_avatar", "like_count", "created_at", "updated_at")
+
+def requested_fields():
+    # ?fields=name,description selects a subset; the id is always included
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    if not fields:
+        return public_fields
+    unknown = [field for field in fields if field not in public_fields]
+    if unknown:
+        raise Exception("Unknown fields: " + ", ".join(unknown))
+    return ("id",) + tuple(field for field in fields if field != "id")
+
+def project(image, fields):
+    return {field: image[field] for field in fields if field in image}
+
+def page_limit():
+    return min(max(int(request.args.get('limit', 20)), 1), 100)
+
+def feed(images, cursor, fields, limit):
+    # The next page's URL keeps the field selection and limit
+    next_url = None
+    if cursor:
+        next_url = url_for(request.endpoint, cursor=cursor, limit=limit, fields=request.args.get('fields') or None, **request.view_args)
+    return jsonify({"images": [project(image, fields) for image in images], "cursor": cursor, "next": next_url})
+
+@bp.after_request
+def represent(response):
+    # Listings and records are private to logged in users, but clients may keep and revalidate them
+    if response.status_code == 200:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return flask_app.extensions['compression'].represent(response)
+
+@bp.route('/images', methods=['GET'])
+def images():
+    """
+    Images API controller.
+
+    Returns a page of the feed of all images, newest first.
+
+    Returns:
+    obj: JSON with the image records, the cursor for the following page and its URL
+
+    """
+    try:
+        fields = requested_fields()
+        limit = page_limit()
+        image_model = Image()
+        images, cursor = image_model.get_images(limit, request.args.get('cursor'))
+    except Exception as err:
+        return jsonify({"error": str(err)}), 400
+
+    return feed(images, cursor, fields, limit)
+
+@bp.route('/images/<image_id>', methods=['GET'])
+def image(image_id):
+    """
+    Image API controller.
+
+    Returns a single image record, e.g. for the image modal.
+
+    Returns:
+    obj: JSON with the image record
+
+    """
+    try:
+        fields = requested_fields()
+        image_model = Image()
+        image = image_model.get_image(image_id)
+    except Exception as err:
+        return jsonify({"error": str(err)}), 400
+    if not image:
+        return jsonify({"error": "This image does not exist."}), 404
+
+    return jsonify({"image": project(image, fields)})
+
+@bp.route('/categories/<category>', methods=['GET'])
+def category(category):
+    """
+    Category API controller.
+
+    Returns a page of a category's feed, newest first.
+
+    Returns:
+    obj: JSON with the image records, the cursor for the following page and its URL
+
+    """
+    try:
+        fields = requested_fields()
+        limit = page_limit()
+        image_model = Image()
+        images, cursor = image_model.get_category_images(category, limit, request.args.get('cursor'))
+    except Exception as err:
+        return jsonify({"error": str(err)}), 400
+
+    return feed(images, cursor, fields, limit)
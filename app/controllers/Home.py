@@ -12,13 +12,13 @@ def index():
     images = []
     try:
         image_model = Image()
-        images = image_model.get_images()
+        images, cursor = image_model.get_images()
     except Exception as err:
         error = err
     if error:
         flash(str(error))
 
-    return render_template('home.html', images=images)
+    return render_template('Home.html', images=images)
 
 @bp.errorhandler(404)
 def error404(e):
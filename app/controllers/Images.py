@@ -9,30 +9,34 @@ def images():
 
     error = None
     images = []
+    cursor = None
     try:
         image_model = Image()
-        images = image_model.get_images()
+        images, cursor = image_model.get_images(cursor=request.args.get('cursor'))
     except Exception as err:
         error = err
     if error:
         flash(str(error))
 
-    return render_template('images/images.html', images=images, title="All Images")
+    feed_url = url_for('images.feed')
+    return render_template('images/images.html', images=images, title="All Images", cursor=cursor, feed_url=feed_url)
    
 @bp.route('/my-images', methods=['GET', 'POST'])
 def my_images():
 
     error = None
     images = []
+    cursor = None
     try:
         image_model = Image()
-        images = image_model.get_user_images()
+        images, cursor = image_model.get_user_images(cursor=request.args.get('cursor'))
     except Exception as err:
         error = err
     if error:
         flash(str(error))
 
-    return render_template('images/my-images.html', images=images, title="My Images")
+    feed_url = url_for('images.feed', mine=1)
+    return render_template('images/my-images.html', images=images, title="My Images", cursor=cursor, feed_url=feed_url)
    
 @bp.route('/upload', methods=['GET', 'POST'])
 def upload():
@@ -56,17 +60,143 @@ def category(category):
 
     error = None
     images = []
+    cursor = None
     category_name = category.replace('-', ' ').title()
     title = category_name + " Images"
     try:
         image_model = Image()
-        images = image_model.get_category_images(category)
+        images, cursor = image_model.get_category_images(category, cursor=request.args.get('cursor'))
     except Exception as err:
         error = err
     if error:
         flash(str(error))
 
-    return render_template('images/images.html', images=images, title=title)
+    feed_url = url_for('images.feed', category=category)
+    return render_template('images/images.html', images=images, title=title, cursor=cursor, feed_url=feed_url)
+
+@bp.route('/trending', methods=['GET'])
+def trending():
+
+    error = None
+    images = []
+    cursor = None
+    try:
+        image_model = Image()
+        images, cursor = image_model.get_trending_images(cursor=request.args.get('cursor'))
+    except Exception as err:
+        error = err
+    if error:
+        flash(str(error))
+
+    feed_url = url_for('images.feed', trending=1)
+    return render_template('images/images.html', images=images, title="Trending", cursor=cursor, feed_url=feed_url)
+
+@bp.route('/trending.json', methods=['GET'])
+def trending_api():
+    """
+    Trending controller.
+
+    Returns a page of the trending feed, best first, with each image's score.
+
+    Returns:
+    obj: JSON with the image records and the cursor for the following page
+
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        image_model = Image()
+        images, cursor = image_model.get_trending_images(limit, request.args.get('cursor'))
+    except Exception as err:
+        return jsonify({"error": str(err)}), 400
+
+    return jsonify({"images": images, "cursor": cursor})
+
+@bp.route('/search', methods=['GET'])
+def search():
+
+    error = None
+    images = []
+    cursor = None
+    query = request.args.get('q', '').strip()
+    try:
+        image_model = Image()
+        images, cursor = image_model.search_images(query, cursor=request.args.get('cursor'))
+    except Exception as err:
+        error = err
+    if error:
+        flash(str(error))
+
+    feed_url = url_for('images.feed', q=query)
+    return render_template('images/images.html', images=images, title='Search: "' + query + '"', cursor=cursor, feed_url=feed_url)
+
+@bp.route('/search.json', methods=['GET'])
+def search_api():
+    """
+    Search controller.
+
+    Returns a page of the images matching the q parameter, best first, with each image's score.
+
+    Returns:
+    obj: JSON with the image records and the cursor for the following page
+
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        image_model = Image()
+        images, cursor = image_model.search_images(request.args.get('q', ''), limit, request.args.get('cursor'))
+    except Exception as err:
+        return jsonify({"error": str(err)}), 400
+
+    return jsonify({"images": images, "cursor": cursor})
+
+@bp.route('/popular', methods=['GET'])
+def popular():
+
+    error = None
+    images = []
+    try:
+        image_model = Image()
+        images = image_model.get_popular_images()
+    except Exception as err:
+        error = err
+    if error:
+        flash(str(error))
+
+    # A single page: like counts are not a stable pagination key
+    return render_template('images/images.html', images=images, title="Most Liked", cursor=None, feed_url=None)
+
+@bp.route('/feed', methods=['GET'])
+def feed():
+    """
+    Feed controller.
+
+    Returns the next page of a feed as rendered grid tiles, for infinite scroll.
+
+    Returns:
+    obj: JSON with the tile html and the cursor for the following page
+
+    """
+
+    cursor = request.args.get('cursor')
+    category = request.args.get('category')
+    template = 'images/tiles.html'
+    try:
+        image_model = Image()
+        if category:
+            images, cursor = image_model.get_category_images(category, cursor=cursor)
+        elif request.args.get('q'):
+            images, cursor = image_model.search_images(request.args.get('q'), cursor=cursor)
+        elif request.args.get('trending'):
+            images, cursor = image_model.get_trending_images(cursor=cursor)
+        elif request.args.get('mine'):
+            images, cursor = image_model.get_user_images(cursor=cursor)
+            template = 'images/my-tiles.html'
+        else:
+            images, cursor = image_model.get_images(cursor=cursor)
+    except Exception as err:
+        return jsonify({"error": str(err)}), 400
+
+    return jsonify({"html": render_template(template, images=images), "cursor": cursor})
     
    
 @bp.route('/edit/<image_id>', methods=['GET', 'POST'])
@@ -82,15 +212,44 @@ def edit(image_id):
             flash("This image has been updated")
         except Exception as err:
             error = err
+    duplicates = []
+    similar = []
     try:
         image_model = Image()
-        image = image_model.get_image(image_id)
+        # The image and the similarity index (a full read when cold) are fetched side by side
+        results = flask_app.extensions['queries'].run({
+            "image": lambda: image_model.get_image(image_id),
+            "similarity": flask_app.extensions['similarity'].ensure_loaded
+        })
+        image = results["image"].result()
+        if results["similarity"].ok:
+            duplicates, similar = image_model.get_similar_images(image)
     except Exception as err:
         error = err
     if error:
         flash(str(error))
 
-    return render_template('images/edit.html', image=image)
+    return render_template('images/edit.html', image=image, duplicates=duplicates, similar=similar)
+
+@bp.route('/status/<image_id>', methods=['GET'])
+def status(image_id):
+    """
+    Status controller.
+
+    Reports the background processing status of an upload, polled by the edit page.
+
+    Returns:
+    obj: JSON with the status and, once ready, the image sizes
+
+    """
+
+    try:
+        image_model = Image()
+        image = image_model.get_image(image_id) or {}
+    except Exception as err:
+        return jsonify({"error": str(err)}), 400
+
+    return jsonify({"status": image.get('status', 'ready'), "sizes": image.get('sizes', [])})
 
 @bp.route('/delete/<image_id>', methods=['GET'])
 def delete(image_id):
@@ -108,3 +267,33 @@ def delete(image_id):
         flash('This image has been deleted')
 
     return redirect(url_for('images.my_images'))
+
+@bp.route('/replica', methods=['GET'])
+def replica():
+    """
+    Replica controller.
+
+    Reports the size and freshness of the local replica, if it is enabled.
+
+    Returns:
+    obj: JSON replica statistics
+
+    """
+    replica = flask_app.extensions.get('replica')
+    if replica is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(replica.stats(), enabled=True))
+
+@bp.route('/cache', methods=['GET'])
+def cache():
+    """
+    Cache controller.
+
+    Reports the listing cache hit/miss counters.
+
+    Returns:
+    obj: JSON cache statistics
+
+    """
+
+    return jsonify(flask_app.extensions['image_cache'].stats())
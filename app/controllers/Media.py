@@ -0,0 +1,87 @@
+import os
+from app.models.Image import Image
+from app.classes.Upload import Upload
+from app.classes.Filters import Filters
+from flask import Blueprint, request, send_file, redirect, url_for
+from flask import current_app as flask_app
+
+bp = Blueprint('media', __name__, url_prefix='/media')
+
+@bp.app_template_filter('media_url')
+def media_url(location):
+    """
+    Template filter.
+
+    Points an upload location at the negotiating media route, so the client
+    receives WebP/AVIF when it accepts them.
+
+    """
+    prefix = '/static/uploads/'
+    if location and location.startswith(prefix):
+        return '/media/uploads/' + location[len(prefix):]
+    return location
+
+@bp.route('/uploads/<path:filename>', methods=['GET'])
+def upload(filename):
+    """
+    Upload media controller.
+
+    Serves the smallest stored variant of an upload (original, WebP or AVIF)
+    that the request's Accept header allows.
+
+    Returns:
+    obj: The image file
+
+    """
+
+    variant = Upload().negotiate(filename, request.accept_mimetypes)
+    if variant is None:
+        return 'This image does not exist.', 404
+
+    path, mimetype = variant
+    assets = flask_app.extensions['assets']
+    if assets.is_immutable(filename):
+        # The path is the content hash, so it doubles as a strong ETag
+        etag = os.path.basename(path)
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=etag, max_age=assets.immutable_max_age)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        # Older uploads were named by id and could be overwritten (e.g. avatars), so revalidate them
+        response = send_file(path, mimetype=mimetype, conditional=True, max_age=0)
+        response.cache_control.no_cache = True
+    response.vary.add('Accept')
+    return response
+
+@bp.route('/filtered/<image_id>/<filter_name>/<int:width>', methods=['GET'])
+@bp.route('/filtered/<image_id>/<filter_name>/<int:width>/<int:version>', methods=['GET'])
+def filtered(image_id, filter_name, width, version=None):
+    """
+    Filtered image controller.
+
+    Serves an image with its filter baked in server-side, at a bounded width,
+    so browsers no longer apply the CSS filter to every tile. The URL carries
+    the filter catalogue version, so renditions cached for a year are
+    fetched again once the catalogue changes; other versions redirect to
+    the current one.
+
+    Returns:
+    obj: The rendered image file
+
+    """
+    if version != Filters.version:
+        return redirect(url_for('media.filtered', image_id=image_id, filter_name=filter_name, width=width, version=Filters.version))
+
+    try:
+        image_model = Image()
+        path, mimetype = image_model.get_filtered(image_id, filter_name, width, request.accept_mimetypes)
+    except Exception as err:
+        return str(err), 404
+
+    # An image's original never changes, and the filter, width and catalogue version are part of the URL
+    assets = flask_app.extensions['assets']
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=assets.immutable_max_age)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
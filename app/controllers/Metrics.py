@@ -0,0 +1,40 @@
+import hmac
+from flask import Blueprint, Response, jsonify, request
+from flask import current_app as flask_app
+
+bp = Blueprint('metrics', __name__, url_prefix='/metrics')
+
+def authorised():
+    # Scrapers authenticate with METRICS_TOKEN rather than a session; without one the endpoints stay closed
+    token = flask_app.config.get('METRICS_TOKEN')
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token)
+
+@bp.route('', methods=['GET'])
+def index():
+    """
+    Metrics controller.
+
+    Serves this worker's request, Firebase call, upload and rendering histograms for Prometheus.
+
+    Returns:
+    obj: Prometheus text exposition
+
+    """
+    if not authorised():
+        return Response('Unauthorised\n', 401, mimetype='text/plain')
+    return Response(flask_app.extensions['metrics'].render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/profiles', methods=['GET'])
+def profiles():
+    """
+    Profiles controller.
+
+    Returns the folded stacks of this worker's recent slow requests, when the profiler is enabled.
+
+    Returns:
+    obj: JSON list of profiles
+
+    """
+    if not authorised():
+        return jsonify({"error": "Unauthorised"}), 401
+    return jsonify(list(flask_app.extensions['metrics'].profiles))
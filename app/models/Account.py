@@ -1,6 +1,7 @@
 from app.classes.Database import Database
 from app.classes.Upload import Upload
 from app.models.User import User
+from app.models.Image import Image
 from flask import session, flash
 from flask import current_app as flask_app
 
@@ -87,6 +88,9 @@ class Account():
                     user = database.login(email, password)
                     # TODO Remove for production
                     #flask_app.logger.info(user)
+                    if isinstance(user.get('likes'), list):
+                        # Converts likes stored as a list to one node per image
+                        database.set_likes(user['localId'], user['likes'])
                     self.user.set_user(user)
                 except Exception as err:
                     error = err
@@ -127,8 +131,22 @@ class Account():
                     file = request.files['avatar']
                     if file.filename:
                         uploader = Upload()
-                        avatar = uploader.upload(file, session['user']['localId'])
+                        stored = uploader.upload(file, self.user.get_upload_limit(), perceptual=False)
+                        avatar = stored["location"]
+                        blob = stored["blob"]
+                        database = Database()
+                        database.retain_blob(blob, "/" + avatar.strip("/"))
+                        if not uploader.exists(avatar):
+                            # The same content was being deleted as it was stored
+                            if database.release_blob(blob):
+                                uploader.remove_blob(avatar, lambda: database.blob_retained(blob))
+                            raise Exception("This avatar could not be stored, please try again.")
+                        # Releases the previous avatar, unlinking it if nothing else uses it
+                        previous = session['user'].get('avatar_blob')
+                        if previous and database.release_blob(previous):
+                            uploader.remove_blob(session['user']['avatar'], lambda: database.blob_retained(previous))
                         session['user']['avatar'] = "/" + avatar.strip("/")
+                        session['user']['avatar_blob'] = blob
                 try:
                     session['user']['first_name'] = first_name
                     session['user']['last_name'] = last_name
@@ -150,37 +168,53 @@ class Account():
         """
         Like method.
 
-        Processes POST request, adds/removes the image from the user's 'liked images' or 'unliked images'
+        Processes a like request, adds/removes the image from the user's 'liked images'
 
         Parameters:
-            request (obj): The POST request object (the like)
+            request (obj): The request object (the like)
 
         Raises:
             error (exception): Error from failed Firebase data request
 
         """
-        # DB checks the users likes in regards to image IDs               
-        changed = False
+        # Return change upon success
+        return image_id in self.toggle_likes({image_id: like == 'true'})
+
+    def toggle_likes(self, changes):
+        """
+        Like method.
+
+        Applies a batch of likes/unlikes to the session straight away and
+        buffers the actual changes, which are written to Firebase in the background.
+
+        Parameters:
+            changes (dict): image ID -> True to like, False to unlike
+
+        Returns:
+            dict: the image IDs whose state changed, with their new state
+
+        """
         likes = session['user']['likes']
+        buffer = flask_app.extensions['likes']
+        changed = {}
+
+        image_model = Image()
+        for image_id, liked in changes.items():
+            # Only changes are buffered, e.g. a second like of the same image is ignored
+            if liked and image_id not in likes:
+                if not Database.valid_key(image_id) or not image_model.get_image(image_id):
+                    # Unknown or deleted images cannot be liked
+                    continue
+                likes.add(image_id)
+            elif not liked and image_id in likes:
+                likes.discard(image_id)
+            else:
+                continue
+            buffer.record(session['user']['localId'], image_id, liked)
+            changed[image_id] = liked
 
-        # Firebase checks the whether the image is in the user's 'liked images' or 'unliked images' lists.
-        if like == 'true':
-            if image_id not in likes:
-                likes.append(image_id)
-                changed = True
-        else:
-            if image_id in likes:
-                likes.remove(image_id)
-                changed = True
-
-        if changed:
-            session['user']['likes'] = likes
-            database = Database()
-            database.update_user(session['user'])
-            session.modified = True
-        # Return change upon success
         return changed
-        
+
     def logout(self):
         """
         Logout method
@@ -188,6 +222,8 @@ class Account():
         Processes logout request, and logs the user out of Firebase upon success.
 
         """
+        # Writes any buffered likes, so they are there when the user logs back in
+        flask_app.extensions['likes'].flush()
         # Logs the user out of Firebase. 
         self.user.unset_user()
 
@@ -1,31 +1,37 @@
 from app.classes.Database import Database
 from app.classes.Upload import Upload
+from app.classes.Filters import Filters
+from app.classes.PageCache import PageCache
 from app.models.User import User
 from flask import session
 from flask import current_app as flask_app
-import uuid, time
+from PIL import Image as PILImage
+from app import SITE_ROOT
+import os, uuid, time, logging
+
+logger = logging.getLogger(__name__)
 
 class Image():
     # Initialises the class
     def __init__(self):
         return None
 
-    def get_images(self, limit=20):
+    def get_images(self, limit=20, cursor=None):
         """
         Get method.
 
-        Processes request, fetches image IDs from DB, and limits the number displayed to 20.
+        Processes request, fetches a page of images from DB, and returns it with the cursor for the next page.
         """
         error = None
         images = False
         # Validates and sends the request to the DB.
         try:
             database = Database()
-            images = database.get_images(limit)
+            images = self.cached_feed("all", None, cursor, limit, lambda: database.get_images(limit, cursor=cursor))
 
         except Exception as err:
              # Identifies if flask is the cause of the error, and raises error if true.
-            flask_app.logger.info(err)
+            logger.info('Image request failed: %s', err)
             error = err
 
         if error:
@@ -35,11 +41,11 @@ class Image():
             # Return on success. 
             return images
 
-    def get_category_images(self, category, limit=20):
+    def get_category_images(self, category, limit=20, cursor=None):
         """
         Get method
 
-        Fetches image IDs from a selected category from the DB, and limits the number displayed to 20. 
+        Fetches a page of images from a selected category from the DB, along with the cursor for the next page. 
         """
         
         error = None
@@ -47,11 +53,11 @@ class Image():
         # Validates and sends the request to the DB.
         try:
             database = Database()
-            images = database.get_category_images(category, limit)
+            images = self.cached_feed("category", category, cursor, limit, lambda: database.get_category_images(category, limit, cursor))
 
         except Exception as err:
              # Identifies if flask is the cause of the error, and raises error if true.
-            flask_app.logger.info(err)
+            logger.info('Image request failed: %s', err)
             error = err
 
         if error:
@@ -61,6 +67,77 @@ class Image():
             # Return on success. 
             return images
 
+    def get_trending_images(self, limit=20, cursor=None):
+        """
+        Get method.
+
+        Fetches a page of the trending feed from the in-process ranking, along
+        with the cursor (an offset into the ranking) for the next page.
+        """
+        if cursor and not cursor.isdigit():
+            raise Exception("This page link is no longer valid.")
+        images, next_offset = flask_app.extensions['trending'].top(limit, int(cursor or 0))
+        return images, (str(next_offset) if next_offset is not None else None)
+
+    def search_images(self, query, limit=20, cursor=None):
+        """
+        Get method.
+
+        Searches the image names, descriptions, categories and user names in
+        the local search index, returning a page of matches, best first, with
+        the cursor (an offset into the results) for the next page.
+        """
+        if cursor and not cursor.isdigit():
+            raise Exception("This page link is no longer valid.")
+        images, next_offset = flask_app.extensions['search'].search(query, limit, int(cursor or 0))
+        return images, (str(next_offset) if next_offset is not None else None)
+
+    def get_similar_images(self, image):
+        """
+        Get method.
+
+        Looks up the images that look like this one in the local similarity
+        index: near-duplicates (the same picture, e.g. resized or saved in
+        another format) and visually similar images, closest first.
+
+        Returns:
+        tuple: (duplicates, similar) lists of image records
+        """
+        if not image:
+            return [], []
+        index = flask_app.extensions['similarity']
+        duplicates = index.duplicates(image)
+        duplicate_ids = {duplicate["id"] for duplicate in duplicates}
+        similar = [match for match in index.similar(image) if match["id"] not in duplicate_ids]
+        return duplicates, similar
+
+    def get_popular_images(self, limit=40):
+        """
+        Get method.
+
+        Fetches the most liked images from the DB. Like counts change often, so
+        the list is cached for the cache TTL rather than invalidated per like.
+        """
+        error = None
+        images = False
+        try:
+            database = Database()
+            cache = flask_app.extensions['image_cache']
+            images = cache.get_or_load(("popular", limit), lambda: database.get_popular_images(limit),
+                                       lambda images: ["image:" + image["id"] for image in images])
+
+        except Exception as err:
+            # Identifies if flask is the cause of the error, and raises error if true.
+            logger.info('Image request failed: %s', err)
+            error = err
+
+        if error:
+            # Raise error from failed Firebase request.
+            raise Exception(error)
+        else:
+            # Return on success.
+            return images
+
     def get_image(self, image_id):
         """
         Get method.
@@ -73,11 +150,18 @@ class Image():
         # Validates the request and fetches the ID from the DB.
         try:
             database = Database()
-            image = database.get_image(image_id)
+            cache = flask_app.extensions['image_cache']
+            found, image = cache.lookup(("image", image_id))
+            if not found:
+                generation = cache.generation()
+                image = database.get_image(image_id)
+                # Misses are not kept, so an image written a moment ago is found once it exists
+                if image is not None:
+                    cache.store(("image", image_id), image, ["image:" + image_id], generation)
 
         except Exception as err:
              # Identifies if flask is the cause of the error, and raises error if true.
-            flask_app.logger.info(err)
+            logger.info('Image request failed: %s', err)
             error = err
 
         if error:
@@ -87,6 +171,49 @@ class Image():
             # Return on success
             return image
 
+    def get_filtered(self, image_id, filter_name, width, accept=None):
+        """
+        Get method.
+
+        Returns the path and mimetype of an image rendered with a filter at a
+        bounded width, in the most compact format the client accepts.
+        Renditions are created on first request and kept in the on-disk
+        rendition cache.
+        """
+        filters = Filters()
+        if not filters.exists(filter_name):
+            raise Exception('This filter does not exist.')
+        if width not in flask_app.config['FILTER_WIDTHS']:
+            raise Exception('This size is not available.')
+
+        image = self.get_image(image_id)
+        if not image:
+            raise Exception('This image does not exist.')
+
+        # Keep transparency for png/gif uploads, everything else falls back to jpeg
+        source = os.path.join(SITE_ROOT, image['upload_location'].strip('/'))
+        transparent = not source.lower().endswith(('.jpg', '.jpeg'))
+        if transparent:
+            extension, mimetype, image_format, options = 'png', 'image/png', 'PNG', {'optimize': True}
+        else:
+            extension, mimetype, image_format, options = 'jpg', 'image/jpeg', 'JPEG', {'quality': 85, 'optimize': True}
+        accepted = Upload().accepted_formats(accept) if accept is not None else []
+        if accepted:
+            extension, mimetype, image_format, options = accepted[0]
+        name = '{0}-{1}-{2}-v{3}.{4}'.format(image_id, filter_name, width, filters.version, extension)
+
+        def render(path):
+            with PILImage.open(source) as original:
+                rendition = original.convert('RGBA' if transparent else 'RGB')
+                if width < rendition.width:
+                    height = round(rendition.height * width / rendition.width)
+                    rendition = rendition.resize((width, height), PILImage.LANCZOS)
+                rendition = filters.apply(rendition, filter_name)
+                rendition.save(path, image_format, **options)
+
+        path = flask_app.extensions['renditions'].get_or_create(name, render)
+        return path, mimetype
+
     def delete_image(self, image_id):
         """
         Delete method.
@@ -99,11 +226,21 @@ class Image():
         # Validates the request, fetches the ID from the DB, and deletes it from the DB.
         try:
             database = Database()
+            image = database.get_image(image_id) or {}
+            flask_app.extensions['likes'].discard(image_id)
             database.delete_image(image_id)
+            flask_app.extensions['trending'].remove(image_id)
+            flask_app.extensions['search'].remove(image_id)
+            flask_app.extensions['similarity'].remove(image_id)
+            # The file is only unlinked once no other image or avatar uses the same content.
+            if image.get('blob') and database.release_blob(image['blob']):
+                Upload().remove_blob(image['upload_location'], lambda: database.blob_retained(image['blob']))
+            # Drops only the cached pages that contained this image.
+            flask_app.extensions['image_cache'].invalidate("image:" + image_id)
 
         except Exception as err:
             # Identifies if flask is the cause of the error, and raises error if true.
-            flask_app.logger.info(err)
+            logger.info('Image request failed: %s', err)
             error = err
 
         if error:
@@ -113,11 +250,11 @@ class Image():
             # Return on success.
             return
 
-    def get_user_images(self, limit=20):
+    def get_user_images(self, limit=20, cursor=None):
         """
         Get method.
 
-        Fetches the user's images from the 'my images' list in the DB, and displays a maximum of 20 images from this list.
+        Fetches a page of the user's images from the 'my images' list in the DB, along with the cursor for the next page.
         """
         
         # Validates required registration fields.
@@ -129,11 +266,11 @@ class Image():
         try:
             # Attempts to fetch the images associated with the users' ID from the DB.
             database = Database()
-            images = database.get_images(limit, user_id)
+            images = self.cached_feed("user", user_id, cursor, limit, lambda: database.get_images(limit, user_id, cursor))
 
         except Exception as err:
             # Identifies if flask is the cause of the error, and raises error if true.
-            flask_app.logger.info(err)
+            logger.info('Image request failed: %s', err)
             error = err
 
         if error:
@@ -143,6 +280,44 @@ class Image():
             # Return on success.
             return images
 
+    def cached_feed(self, feed, value, cursor, limit, loader):
+        """
+        Cache method.
+
+        Reads a feed page through the listing cache. Pages are tagged with the
+        images they contain and the feed they belong to, and first pages with
+        the feed head that new uploads land on.
+        """
+        cache = flask_app.extensions['image_cache']
+        page = cache.get_or_load((feed, value, cursor, limit), loader, self.page_tags(feed, value, cursor))
+        # Pages rendered from this feed page go stale with it
+        PageCache.depends(self.page_tags(feed, value, cursor)(page))
+        return page
+
+    def page_tags(self, feed, value, cursor):
+        """
+        Cache method.
+
+        Returns the function tagging a loaded feed page.
+        """
+        def page_tags(page):
+            images, next_cursor = page
+            tags = ["image:" + image["id"] for image in images]
+            tags.append(self.feed_tag("feed", feed, value))
+            if not cursor:
+                tags.append(self.feed_tag("head", feed, value))
+            return tags
+
+        return page_tags
+
+    def feed_tag(self, scope, feed, value):
+        """
+        Cache method.
+
+        Builds the cache tag for a whole feed ("feed") or its first page ("head").
+        """
+        return ":".join([scope, feed, str(value or "")])
+
     def upload(self, request):
         """
         Upload method.
@@ -191,10 +366,21 @@ class Image():
                 # Attempts to send the following information to the DB asssociated with the image ID in the following format.
                 try: 
                     uploader = Upload()
-                    upload_location = uploader.upload(file, image_id)
+                    stored = uploader.upload(file, User().get_upload_limit())
+                    upload_location = stored["location"]
+                    blob = stored["blob"]
                     image_data = {
                         "id":                   image_id,
                         "upload_location":      '/' + upload_location,
+                        "blob":                 blob,
+                        "width":                stored["width"],
+                        "height":               stored["height"],
+                        "bytes":                stored["bytes"],
+                        "ahash":                stored["hashes"]["ahash"],
+                        "dhash":                stored["hashes"]["dhash"],
+                        "phash":                stored["hashes"]["phash"],
+                        "sizes":                [],
+                        "status":               "processing",
                         "user_id":              user_id,
                         "user_name":            user_name,
                         "user_avatar":          user_avatar,
@@ -205,37 +391,111 @@ class Image():
                         "created_at":           int(time.time())
                     }
                     database = Database()
+                    database.retain_blob(blob, '/' + upload_location)
+                    if not uploader.exists(upload_location):
+                        # The same content was being deleted as it was stored
+                        if database.release_blob(blob):
+                            uploader.remove_blob(upload_location, lambda: database.blob_retained(blob))
+                        raise Exception("This image could not be stored, please try again.")
                     uploaded = database.save_image(image_data, image_id)
+                    flask_app.extensions['trending'].add(image_data)
+                    flask_app.extensions['search'].add(image_data)
+                    flask_app.extensions['similarity'].add(image_data)
+                    # New images land at the head of each feed, so only first pages go stale.
+                    flask_app.extensions['image_cache'].invalidate(
+                        self.feed_tag("head", "all", None),
+                        self.feed_tag("head", "category", category),
+                        self.feed_tag("head", "user", user_id))
+                    # Derivatives are generated in the background once the record exists.
+                    flask_app.extensions['jobs'].enqueue("upload", {"image_id": image_id, "upload_location": upload_location})
                 except Exception as err:
                     # Raise error upon failed Firebase upload.
                     error = err
         if error:
             # Raises an error if Flask fails to upload the information to Firebase, and displays a message for the user.
-            flask_app.logger.info('################ UPLOAD ERROR #######################')
-            flask_app.logger.info(error)
+            logger.info('Image upload failed: %s', error)
             raise Exception(error)
         else:
             # Returns image ID upon successful upload.
             return image_id
 
+    @staticmethod
+    def process_upload(payload):
+        """
+        Job method.
+
+        Runs in a worker process: generates the derivatives and modern format copies for an upload.
+        """
+        uploader = Upload()
+        sizes = uploader.make_derivatives(payload["upload_location"])
+        # Every size, including the original, also gets WebP/AVIF copies for content negotiation
+        for size in sizes or [{"location": payload["upload_location"]}]:
+            uploader.transcode(size["location"])
+        return {"sizes": sizes}
+
+    @staticmethod
+    def complete_upload(payload, result):
+        """
+        Job method.
+
+        Stores the generated derivatives on the image record and marks it ready.
+        """
+        database = Database()
+        # The same fields, stamped with their new version, go to the local indexes
+        fields = database.update_image_fields({"sizes": result["sizes"], "status": "ready"}, payload["image_id"])
+        flask_app.extensions['image_cache'].invalidate("image:" + payload["image_id"])
+        flask_app.extensions['trending'].update(payload["image_id"], fields)
+        flask_app.extensions['similarity'].update(payload["image_id"], fields)
+
+    @staticmethod
+    def fail_upload(payload, error):
+        """
+        Job method.
+
+        Marks the image record as failed once processing runs out of attempts.
+        """
+        database = Database()
+        fields = database.update_image_fields({"status": "failed"}, payload["image_id"])
+        flask_app.extensions['image_cache'].invalidate("image:" + payload["image_id"])
+        flask_app.extensions['trending'].update(payload["image_id"], fields)
+
     def update(self, image_id, request):
         """
         Update method.
 
         Requests that the information associated with an image ID is updated (on the Firebase list for that particular image ID) based on the information the user enters.
         """
+        error = None
+        try:
+            image_data = self.get_update_data(image_id, request)
+            database = Database()
+            uploaded = database.update_image(image_data, image_id)
+            self.updated(image_id, image_data, request)
+        except Exception as err:
+            # Raise error if update was unsuccessful, as the information could not be sent to the DB.
+            error = err
+        if error:
+            # Identifies if flask is causing the error. If true: raise error and displays this error to the user.
+            logger.info('Image update failed: %s', error)
+            raise Exception(error)
+        else:
+            # Returns the image ID upon success and updates the image information.
+            return
+
+    def get_update_data(self, image_id, request):
+        """
+        Update method.
+
+        Validates the edit form and returns the image data to store.
+        """
         # Fills the form with the new input from the user
         name            = request.form['name']
         description     = request.form['description']
         category        = request.form['category']
         image_filter    = request.form['filter']
-        created_at      = request.form['created_at'] 
+        created_at      = int(request.form['created_at'])
         upload_location = request.form['upload_location']  
 
-        # Validates required registration fields
-        error = None
-        user_id = False
-
         # Checks that the user is logged in based on the userID and localID. 
         if (session['user'] and session['user']['localId']):
             user_id     = session['user']['localId']
@@ -243,41 +503,40 @@ class Image():
             user_avatar = session['user']['avatar']
         else: 
             # Raises error upon failed update as the user is not logged in.
-            error = 'You must be logged in to update an image.'
+            raise Exception('You must be logged in to update an image.')
 
         # Validates the required fields to check for missing information, and raises an error based on the missing info.
-        if not error:
-            if not name:
-                error = 'An name is required.'
-            elif not description:
-                error = 'A description is required.'
-            elif not category:
-                error = 'A category is required.'
-            else:
-                try:
-                    # Tries another method to update the image information, attempting to send it to the specified image ID in the DB.
-                    image_data = {
-                        "id":                   image_id,
-                        "upload_location":      upload_location,
-                        "user_id":              user_id,
-                        "user_name":            user_name,
-                        "user_avatar":          user_avatar,
-                        "name":                 name,
-                        "description":          description,
-                        "category":             category,
-                        "filter":               image_filter,
-                        "created_at":           created_at
-                    }
-                    database = Database()
-                    uploaded = database.save_image(image_data, image_id)
-                except Exception as err:
-                    # Raise error if update was unsuccessful, as the information could not be sent to the DB.
-                    error = err
-        if error:
-            # Identifies if flask is causing the error. If true: raise error and displays this error to the user.
-            flask_app.logger.info('################ UPDATE ERROR #######################')
-            flask_app.logger.info(error)
-            raise Exception(error)
-        else:
-            # Returns the image ID upon success and updates the image information.
-            return
\ No newline at end of file
+        if not name:
+            raise Exception('An name is required.')
+        elif not description:
+            raise Exception('A description is required.')
+        elif not category:
+            raise Exception('A category is required.')
+
+        return {
+            "id":                   image_id,
+            "upload_location":      upload_location,
+            "user_id":              user_id,
+            "user_name":            user_name,
+            "user_avatar":          user_avatar,
+            "name":                 name,
+            "description":          description,
+            "category":             category,
+            "filter":               image_filter,
+            "created_at":           created_at
+        }
+
+    def updated(self, image_id, image_data, request):
+        """
+        Update method.
+
+        Applies a stored edit to the local indexes and the listing cache.
+        """
+        flask_app.extensions['trending'].update(image_id, image_data)
+        flask_app.extensions['search'].update(image_id, image_data)
+        flask_app.extensions['similarity'].update(image_id, image_data)
+        # Drops the pages containing this image, and any page of a category it moved into.
+        cache_tags = ["image:" + image_id]
+        if image_data["category"] != request.form.get('original_category', image_data["category"]):
+            cache_tags.append(self.feed_tag("feed", "category", image_data["category"]))
+        flask_app.extensions['image_cache'].invalidate(*cache_tags)
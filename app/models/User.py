@@ -1,4 +1,5 @@
 from flask import session
+from flask import current_app as flask_app
 
 class User():
 
@@ -24,10 +25,28 @@ class User():
             return self.user['idToken']
         return False
 
+    def get_upload_limit(self):
+        """
+        Get method.
+
+        Returns the largest upload, in bytes, this user may make: their own
+        limit if their record has one, never more than the global limit.
+        """
+        limit = flask_app.config['UPLOAD_MAX_BYTES']
+        if self.is_logged_in() and self.user.get('upload_limit'):
+            limit = min(limit, self.user['upload_limit'])
+        return limit
+
     def set_user(self, user):
+        # A fresh session id on login, so one handed out before cannot be reused
+        session.regenerate()
         session['logged_in'] = True
         session['user'] = user
-        session['user']['likes'] = user.get('likes', [])
+        likes = user.get('likes') or []
+        # Likes are stored one node per image; older accounts stored a list
+        if isinstance(likes, dict):
+            likes = [image_id for image_id, liked in likes.items() if liked]
+        session['user']['likes'] = set(likes)
         self.get_user()
 
     def unset_user(self):
@@ -1,48 +1,113 @@
 $(document).ready(function(){
 
-	$('i.like').click(function(e) {
-		/*This listens for a click on a like icon. Upon click, the image ID (associated with whichever like icon was clicked) is placed into the user's 
-		'liked images' or 'unliked images' list within the DB. It also allows the appearance of the like button to be changed upon click, as the displayed class of the 
-		button's appearance changes to the other possible class value. */
+	var pendingLikes = {};
+	var likeTimer = null;
+
+	function setLiked(image_id, liked) {
+		/*Shows an image's like state on every tile of it, adjusting the displayed like count when the state changes.*/
+		var $icons = $('i.like[data-image="' + image_id + '"]');
+		if ($icons.hasClass('fas') === liked) {
+			return;
+		}
+		$icons.toggleClass('fas', liked).toggleClass('far', !liked);
+		$('.like-count[data-image="' + image_id + '"]').text(function(i, count) {
+			return Math.max(0, parseInt(count, 10) + (liked ? 1 : -1));
+		});
+	}
+
+	function sendLikes() {
+		/*Sends every toggle made since the last batch in one request. Toggling the same image several times only sends its final state, 
+		and if the request fails the icons are put back as they were.*/
+		var likes = pendingLikes;
+		pendingLikes = {};
+		likeTimer = null;
+		if ($.isEmptyObject(likes)) {
+			return;
+		}
+		$.ajax({
+			url: $SCRIPT_ROOT + '/likes',
+			type: 'POST',
+			contentType: 'application/json',
+			data: JSON.stringify({likes: likes})
+		}).fail(function() {
+			$.each(likes, function(image_id, liked) {
+				setLiked(image_id, !liked);
+			});
+		});
+	}
+
+	$(document).on('click', 'i.like', function(e) {
+		/*This listens for a click on a like icon. The appearance of the like button changes straight away, and the new state is queued. 
+		Queued likes are sent together once the user has stopped clicking for a moment, and the image IDs are placed into the user's 
+		'liked images' list within the DB.*/
 		
 		e.stopPropagation();
 		e.preventDefault();
 
 		var like 		= $(this).hasClass('far');
 		var image_id 	= $(this).data('image');
-		var _this 		= $(this);
 
+		setLiked(image_id, like);
+		pendingLikes[image_id] = like;
+		clearTimeout(likeTimer);
+		likeTimer = setTimeout(sendLikes, 800);
+	});
+
+	$(window).on('pagehide', function() {
+		/*Sends any queued likes before the page is left.*/
+		if (!$.isEmptyObject(pendingLikes) && navigator.sendBeacon) {
+			clearTimeout(likeTimer);
+			navigator.sendBeacon($SCRIPT_ROOT + '/likes', new Blob([JSON.stringify({likes: pendingLikes})], {type: 'application/json'}));
+			pendingLikes = {};
+		}
+	});
+
+	var $grid = $('.grid').masonry({
+		gutter: 30
+	});
+
+	var loading = false;
+	$(window).scroll(function() {
+		/*Infinite scroll. Once the user nears the bottom of the grid, the next page of the feed is requested using the cursor 
+		returned with the previous page, and the new tiles are appended to the masonry layout. Stops once no cursor is returned.*/
+
+		var cursor = $grid.attr('data-cursor');
+		if (loading || !cursor) {
+			return;
+		}
+		if ($(window).scrollTop() + $(window).height() < $(document).height() - 600) {
+			return;
+		}
+
+		loading = true;
 		$.getJSON(
-			$SCRIPT_ROOT + '/like',
+			$grid.data('feed'),
 
 			{
-				like: like,
-				image_id: image_id
-			}, 
+				cursor: cursor
+			},
 			function(result) {
-				if (like) {
-					_this.removeClass('far');
-					_this.addClass('fas');
-				} else {
-					_this.removeClass('fas');
-					_this.addClass('far');
-				}
-				
+				var $items = $($.parseHTML(result.html)).filter('.grid-item');
+				$grid.append($items).masonry('appended', $items);
+				$grid.attr('data-cursor', result.cursor || '');
+				loading = false;
 			}
-		);
+		).fail(function() {
+			loading = false;
+		});
 	});
 
-	var $grid = $('.grid').masonry({
-		gutter: 30
-	});
 
+	$(document).on('click', '.grid-item figure', function(){
+		/*This function listens for a user click on an image defined within the 'grid item' class. Upon click, the image's name, description, 
+		filter and location are fetched from the API, and the modal class of the image is displayed with them.  */ 
 
-	$('.grid-item figure').click(function(){
-		/*This function listens for a user click on an image defined within the 'grid item' class. Upon click, the modal class of the image is displayed, 
-		along with all of the previously created variables defined for values such as: name, description, etc.  */ 
+		var image_id = $(this).closest('.grid-item').attr('data-image');
+		$.getJSON($SCRIPT_ROOT + '/api/v1/images/' + encodeURIComponent(image_id), {fields: 'name,description,filter,upload_location'}, showModal);
+	});
 
-		var image_data = $(this).closest('.grid-item').data(image);
-		var image = image_data.image;
+	function showModal(result) {
+		var image = result.image;
 		var description = `<p>${image.description}</p>`;
 		var title = `<h5 class="modal-title">${image.name}<i class="fa fa-times" data-dismiss="modal" aria-label="Close" aria-hidden="true"></i></h5>`;
 		var img = ` <figure class="filter-${image.filter}">
@@ -50,8 +115,31 @@ $(document).ready(function(){
 					</figure>`;
 		$('#image-modal .modal-body').html(img + title + description);
 		$('.modal').modal('show');
-	});	
+	}
+
 
+	/* Polls the processing status of a fresh upload on the edit page. Once the background job has finished, the generated sizes 
+	are added to the image as a srcset and the processing note is removed.*/
+	function pollStatus() {
+		var $status = $('#image-status');
+		$.getJSON($status.data('status-url'), function(result) {
+			if (result.status === 'processing') {
+				setTimeout(pollStatus, 2000);
+				return;
+			}
+			$status.attr('data-status', result.status);
+			if (result.sizes.length > 0) {
+				var srcset = result.sizes.map(function(size) {
+					return size.location + ' ' + size.width + 'w';
+				});
+				$status.find('img').attr({srcset: srcset.join(', '), sizes: '100vw'});
+			}
+			$('.processing').remove();
+		});
+	}
+	if ($('#image-status[data-status="processing"]').length > 0) {
+		setTimeout(pollStatus, 2000);
+	}
 
 	/* This displays the selected filter on the associated image.*/ 
 	if ($('#filter-select').length > 0 ) {
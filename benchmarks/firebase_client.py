@@ -0,0 +1,70 @@
+"""
+Firebase client benchmark.
+
+Compares requests/sec of the old per-call Database construction (re-reading
+firebase.json and re-initialising pyrebase for every request) against the
+shared, pooled client registered in create_app.
+
+Usage:
+    python benchmarks/firebase_client.py --requests 200 --threads 8 [--image-id ID]
+
+Requires app/firebase.json and app/firebase.admin.json.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyrebase
+import app as application
+from app import SITE_ROOT
+from app.classes.Database import Database
+
+
+def per_call_database():
+    # Mirrors the original Database.__init__: a new pyrebase app per call
+    firebase_config_file = os.path.join(SITE_ROOT, 'firebase.json')
+    firebase_config = json.load(open(firebase_config_file))
+    firebase_config["serviceAccount"] = os.path.join(SITE_ROOT, 'firebase.admin.json')
+    firebase = pyrebase.initialize_app(firebase_config)
+    firebase.auth()
+    return firebase.database()
+
+
+def pooled_database():
+    return Database().db
+
+
+def run(flask_app, factory, image_id, total, threads):
+    def one(_):
+        with flask_app.app_context():
+            factory().child("images").child(image_id).get()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--image-id', default='benchmark')
+    args = parser.parse_args()
+
+    os.environ['FIREBASE_POOL_SIZE'] = str(args.threads)
+    flask_app = application.create_app()
+
+    for name, factory in (('per-call', per_call_database), ('pooled', pooled_database)):
+        rate = run(flask_app, factory, args.image_id, args.requests, args.threads)
+        print('{0:<10} {1:8.1f} req/s'.format(name, rate))
+
+
+if __name__ == '__main__':
+    main()
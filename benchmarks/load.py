@@ -0,0 +1,176 @@
+"""
+Load test benchmark.
+
+Drives the main pages through the Flask test client against the in-process
+Firebase emulator, so no firebase.json, service account or network access
+is needed, and reports each route's throughput and p50/p99 latency. Every
+emulated Firebase request waits --latency seconds, standing in for the
+round-trip to Google's servers.
+
+Usage:
+    python benchmarks/load.py --requests 200 --threads 8 --latency 0.05 [--images 500] [--routes home,images] [--cold]
+
+Uploaded images are deleted again at the end.
+"""
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image as PILImage
+import app as application
+
+CATEGORIES = ['abstract', 'animals-wildlife', 'the-arts', 'food-and-drink', 'travel']
+EMAIL = 'benchmark@example.com'
+PASSWORD = 'benchmark'
+
+
+def seed(flask_app, count):
+    # Writes through Database so the records carry their feed keys
+    from app.classes.Database import Database
+    with flask_app.app_context():
+        database = Database()
+        now = int(time.time())
+        for number in range(count):
+            image_id = 'benchmark-{0:06d}'.format(number)
+            database.save_image({
+                "id": image_id,
+                "upload_location": "/static/img/error404.jpg",
+                "user_id": "benchmark",
+                "user_name": "Benchmark User",
+                "user_avatar": "",
+                "name": "Benchmark image {0}".format(number),
+                "description": "Seeded by the load test",
+                "category": CATEGORIES[number % len(CATEGORIES)],
+                "filter": "",
+                "status": "ready",
+                "sizes": [],
+                "created_at": now - count + number
+            }, image_id)
+
+
+def png(number):
+    # A different colour per upload, or content addressing would store one file
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (64, 64), ((number * 37) % 256, (number * 91) % 256, (number * 53) % 256)).save(buffer, 'PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def routes(images):
+    return {
+        'home': lambda client, number: client.get('/'),
+        'images': lambda client, number: client.get('/images/'),
+        'category': lambda client, number: client.get('/images/category/' + CATEGORIES[number % len(CATEGORIES)]),
+        'like': lambda client, number: client.get('/like', query_string={
+            "image_id": images[number % len(images)], "like": "true" if number % 2 else "false"}),
+        'upload': lambda client, number: client.post('/images/upload', data={
+            "name": "Benchmark upload {0}".format(number), "description": "Uploaded by the load test",
+            "category": CATEGORIES[number % len(CATEGORIES)], "filter": "",
+            "image": (png(number), 'benchmark-{0}.png'.format(number))}),
+    }
+
+
+def uncached(cache, request):
+    def cold(client, number):
+        cache.clear()
+        return request(client, number)
+    return cold
+
+
+def percentile(timings, fraction):
+    # Nearest rank
+    ordered = sorted(timings)
+    return ordered[max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def run(clients, request, total):
+    timings = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker(client):
+        while True:
+            with lock:
+                number = next(counter, None)
+            if number is None:
+                return
+            started = time.perf_counter()
+            response = request(client, number)
+            elapsed = time.perf_counter() - started
+            with lock:
+                timings.append(elapsed)
+                if response.status_code >= 400:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        list(executor.map(worker, clients))
+    return timings, errors[0], time.perf_counter() - start
+
+
+def cleanup(flask_app):
+    from app.classes.Database import Database
+    from app.models.Image import Image
+    jobs = flask_app.extensions['jobs']
+    deadline = time.time() + 60
+    while time.time() < deadline and (jobs.stats().get('pending') or jobs.stats().get('running')):
+        time.sleep(0.2)
+    with flask_app.app_context():
+        flask_app.extensions['likes'].flush()
+        for image_data in Database().get_all_images():
+            if image_data.get('blob'):
+                Image().delete_image(image_data['id'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every Firebase request')
+    parser.add_argument('--images', type=int, default=500, help='images seeded before the run')
+    parser.add_argument('--routes', default='home,images,category,like,upload')
+    parser.add_argument('--cold', action='store_true', help='clear the listing cache before every request')
+    args = parser.parse_args()
+
+    os.environ['FIREBASE_EMULATOR'] = '1'
+    flask_app = application.create_app()
+    emulator = flask_app.extensions['firebase_emulator']
+
+    seed(flask_app, args.images)
+    clients = []
+    for number in range(args.threads):
+        client = flask_app.test_client()
+        if number == 0:
+            client.post('/register', data={"email": EMAIL, "password": PASSWORD, "password_confirm": PASSWORD})
+        client.post('/login', data={"email": EMAIL, "password": PASSWORD})
+        clients.append(client)
+    emulator.latency = args.latency
+
+    images = ['benchmark-{0:06d}'.format(number) for number in range(args.images)]
+    random.shuffle(images)
+    scenarios = routes(images)
+    if args.cold:
+        cache = flask_app.extensions['image_cache']
+        scenarios = {name: uncached(cache, request) for name, request in scenarios.items()}
+    print('{0:<10} {1:>8} {2:>7} {3:>9} {4:>9} {5:>9}'.format('route', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms'))
+    try:
+        for name in args.routes.split(','):
+            timings, errors, elapsed = run(clients, scenarios[name], args.requests)
+            print('{0:<10} {1:>8} {2:>7} {3:>9.1f} {4:>9.1f} {5:>9.1f}'.format(
+                name, len(timings), errors, len(timings) / elapsed,
+                percentile(timings, 0.50) * 1000, percentile(timings, 0.99) * 1000))
+    finally:
+        emulator.latency = 0.0
+        cleanup(flask_app)
+
+
+if __name__ == '__main__':
+    main()